@@ -1,11 +1,111 @@
 from typing import Callable, Union
 from abc import ABC, abstractmethod
-from copy import deepcopy
 
 def find_block(block: str, stacks: list[list[str | int]]) -> int | None:
     """Returns a index of the stack that the block is in OR None"""
     return next((i for (i, stack) in enumerate(stacks) if block in stack), None)
 
+class BlocksState:
+    """Compact BlocksWorld state with O(1) action checks and updates. 
+
+    Stacks are lists (`bottom -> top`) keyed by their bottom block (in the same order as the `[stacks]` list), 
+    and `index` maps every block on the table to `(bottom block, height)`, so finding a block is a dict lookup.
+    The actions change the state in place (a few list / dict entries), so a plan runs on one state, 
+    and `copy` takes a snapshot (O(number of blocks)) wherever a state has to be kept (e.g. a planner node or a cached prefix).
+    Out of place actions (`try_apply`) share the stack lists they do not change with the old state, 
+    so only change a state in place if it is your own copy, and never while it is a dict key or in a set.
+
+    Indexing works like the `(holding, [stacks])` tuple format (`state[0]`, `state[1]`), 
+    so the state can be passed to anything that reads that format (e.g. `state_to_pddl`).
+    Equality and hashing ignore the order of the stacks (and the goal).
+
+    If built with a (complete) goal, `goal_below` maps every block to the block under it in the goal (None for the table), 
+    shared by all states of a plan, and `num_placed` counts the blocks sitting on their goal block. 
+    Actions update the counter in O(1), so the goal is reached when `num_placed == len(goal_below)`.
+    """
+    __slots__ = ('holding', 'stacks', 'index', 'goal_below', 'num_placed', '_hash')
+
+    def __init__(
+            self, 
+            holding: str | int | None, 
+            stacks: dict[str | int, list[str | int]], 
+            index: dict[str | int, tuple[str | int, int]], 
+            goal_below: dict[str | int, str | int | None] | None = None,
+            num_placed: int = 0
+        ) -> None:
+        self.holding = holding
+        self.stacks = stacks
+        self.index = index
+        self.goal_below = {} if goal_below is None else goal_below
+        self.num_placed = num_placed
+        self._hash = None # computed on first use (states are looked up several times during a search), reset by the actions
+
+    @classmethod
+    def from_tuple(cls, state: tuple[str | int | None, list[list[str | int]]], goal: tuple[str | int | None, list[list[str | int]]] = None) -> "BlocksState":
+        """Builds a state from the `(holding, [stacks])` format (returns `state` itself if it already is a `BlocksState` and no `goal` is given).
+        `goal` turns on the goal counter (see above)."""
+        if isinstance(state, BlocksState):
+            if goal is None:
+                return state
+            state = state.to_tuple()
+        stacks = {stack[0] : list(stack) for stack in state[1] if len(stack) > 0}
+        index = {block : (bottom, height) for bottom, stack in stacks.items() for height, block in enumerate(stack)}
+        if goal is None:
+            return cls(state[0], stacks, index)
+
+        goal_below = {block : (stack[height - 1] if height > 0 else None) for stack in goal[1] for height, block in enumerate(stack)}
+        num_placed = sum(goal_below.get(block, False) == (stack[height - 1] if height > 0 else None) for stack in stacks.values() for height, block in enumerate(stack))
+        return cls(state[0], stacks, index, goal_below, num_placed)
+
+    def copy(self, *, share_stacks: bool = False) -> "BlocksState":
+        """Returns a snapshot that the actions can change without touching this state (same goal).
+        With `share_stacks` the stack lists are shared, and the caller has to copy the ones it changes."""
+        stacks = self.stacks.copy() if share_stacks else {bottom : stack.copy() for bottom, stack in self.stacks.items()}
+        return BlocksState(self.holding, stacks, self.index.copy(), self.goal_below, self.num_placed)
+
+    @property
+    def goal_distance(self) -> int | None:
+        """Number of blocks not on their goal block (0 at the goal), or None if the state has no goal."""
+        return len(self.goal_below) - self.num_placed if self.goal_below else None
+
+    def is_goal(self) -> bool:
+        """Single integer compare, only for states built with a goal."""
+        return self.num_placed == len(self.goal_below)
+
+    def to_tuple(self) -> tuple[str | int | None, list[list[str | int]]]:
+        """Returns the state in the `(holding, [stacks])` format, as stored in `solution_results.json`."""
+        return (self.holding, [list(stack) for stack in self.stacks.values()])
+
+    def stack_of(self, block: str | int) -> list[str | int] | None:
+        """Returns the stack that `block` is in OR None"""
+        location = self.index.get(block)
+        return None if location is None else self.stacks[location[0]]
+
+    def __getitem__(self, index: int):
+        return (self.holding, tuple(self.stacks.values()))[index]
+
+    def __iter__(self):
+        return iter((self.holding, tuple(self.stacks.values())))
+
+    def __len__(self) -> int:
+        return 2
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BlocksState):
+            try:
+                other = BlocksState.from_tuple(other)
+            except (TypeError, IndexError):
+                return NotImplemented
+        return self.holding == other.holding and self.stacks == other.stacks # stacks are keyed by their bottom block, so order does not matter
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            self._hash = hash((self.holding, frozenset(map(tuple, self.stacks.values()))))
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f'BlocksState{self.to_tuple()}'
+
 # setup actions
 class BlocksAction(ABC):
     @staticmethod
@@ -32,7 +132,7 @@ class BlocksAction(ABC):
     @classmethod
     def _get_object_selection_functions(cls) -> list[Callable[[tuple[str | int, list[list[str | int]]]], list[str | int]]]:
         """Returns `num_object` functions which map states to suggested objects at each position"""
-        return [lambda state: sum(state[1], []) + ([] if state[0] is None else [state[0]]) for _ in range(cls.get_num_objects())]
+        return [lambda state: [block for stack in state[1] for block in stack] + ([] if state[0] is None else [state[0]]) for _ in range(cls.get_num_objects())]
     
     @classmethod
     def get_suggested_objects(cls, state: tuple[str | int, list[list[str | int]]]) -> list[list[str | int]]:
@@ -58,14 +158,19 @@ class BlocksAction(ABC):
         raise NotImplementedError()
 
     
-    def apply_to_state(self, state: tuple[str | int, list[list[str | int]]]) -> tuple[str | int, list[list[str | int]]]:
+    def apply_to_state(self, state: tuple[str | int, list[list[str | int]]] | BlocksState) -> tuple[str | int, list[list[str | int]]] | BlocksState:
         """Takes an action `(action_tag, [objects])` to state `[holding, [stacks]]` out of place.
         
-        Returns new state `[holding, [stacks]]`
+        Returns new state `[holding, [stacks]]`, or a new `BlocksState` if `state` is a `BlocksState`.
 
         Assumes that `meets_preconditions` has been called, so no checks (for performance).
         """
-        new_state = [state[0], deepcopy(state[1])]
+        if isinstance(state, BlocksState):
+            new_state = state.copy()
+            self._update_blocks_state(new_state, self.objects)
+            return new_state
+
+        new_state = [state[0], [list(stack) for stack in state[1]]] # blocks themselves are never changed, so this is all we need to copy
         self._apply_in_place(new_state)
         return tuple(new_state) # this is a bit weird, but it lets me keep the tuple form without significant changes to how I wrote the other code.
     
@@ -73,13 +178,53 @@ class BlocksAction(ABC):
     def _apply_in_place(self, state: tuple[str | int, list[list[str | int]]]) -> None:
         """Applies the action in place, inner method."""
         raise NotImplementedError()
+
+    @staticmethod
+    @abstractmethod
+    def _check_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> bool:
+        """`meets_preconditions` for a `BlocksState`, without needing an action object, inner method."""
+        raise NotImplementedError()
+
+    @staticmethod
+    @abstractmethod
+    def _update_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> None:
+        """Applies the action to a `BlocksState` in place (no checks), inner method."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _get_changed_stack(state: BlocksState, objects: tuple[str | int, ...]) -> str | int | None:
+        """Bottom block of the stack list that `_update_blocks_state` changes, or None if it only adds / removes whole stacks, inner method."""
+        return None
+
+    @classmethod
+    def try_apply_in_place(cls, state: BlocksState, objects: tuple[str | int, ...]) -> bool:
+        """Checks the preconditions and applies the action to `state` in place, without building an action object.
+        Used as the handler for compiled plans (see `block_code.compile_plan`).
+
+        Returns whether the action was applied (`state` is unchanged otherwise).
+        """
+        if not cls._check_blocks_state(state, objects):
+            return False
+        cls._update_blocks_state(state, objects)
+        return True
+
+    @classmethod
+    def try_apply(cls, state: BlocksState, objects: tuple[str | int, ...]) -> BlocksState | None:
+        """Out of place version of `try_apply_in_place`. Returns the new state, or None if the action is not applicable."""
+        if not cls._check_blocks_state(state, objects):
+            return None
+        new_state = state.copy(share_stacks = True)
+        if (bottom := cls._get_changed_stack(state, objects)) is not None:
+            new_state.stacks[bottom] = new_state.stacks[bottom].copy()
+        cls._update_blocks_state(new_state, objects)
+        return new_state
     
     def __str__(self) -> str:
         return f'({self.get_name()} {" ".join([str(o) for o in self.objects])})'
     
     def __eq__(self, other: Union["BlocksAction", str]) -> bool:
         if isinstance(other, BlocksAction):
-            return self.__str__() == other.__str__()
+            return self.get_name() == other.get_name() and list(self.objects) == list(other.objects)
         elif isinstance(other, str):
             return self.__str__() == other
         else:
@@ -101,6 +246,8 @@ class PickupAction(BlocksAction):
         ]
 
     def meets_preconditions(self, state) -> bool:
+        if isinstance(state, BlocksState):
+            return self._check_blocks_state(state, self.objects)
         return all([
             state[0] is None, # has free hand
             not (stack_index := find_block(self.objects[0], state[1])) is None # block exists on table
@@ -111,6 +258,18 @@ class PickupAction(BlocksAction):
         state[0] = self.objects[0] # now holding
         del state[1][find_block(self.objects[0], state[1])] # not on table
 
+    @staticmethod
+    def _check_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> bool:
+        return state.holding is None and state.index.get(objects[0]) == (objects[0], 0) and len(state.stacks[objects[0]]) == 1 # free hand, single block on the table
+
+    @staticmethod
+    def _update_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> None:
+        del state.stacks[objects[0]] # not on table (it was a single block, so it is the bottom of its stack)
+        del state.index[objects[0]]
+        state.holding = objects[0] # now holding
+        state.num_placed -= state.goal_below.get(objects[0], False) is None # was placed if its goal is the table
+        state._hash = None
+
 
 class PutdownAction(BlocksAction):
     @staticmethod
@@ -134,6 +293,18 @@ class PutdownAction(BlocksAction):
         state[1].append([self.objects[0]]) # put on table
         state[0] = None # not holding
 
+    @staticmethod
+    def _check_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> bool:
+        return state.holding == objects[0] # is holding
+
+    @staticmethod
+    def _update_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> None:
+        state.stacks[objects[0]] = [objects[0]] # put on table
+        state.index[objects[0]] = (objects[0], 0)
+        state.holding = None # not holding
+        state.num_placed += state.goal_below.get(objects[0], False) is None
+        state._hash = None
+
 class StackAction(BlocksAction):
     @staticmethod
     def get_name() -> str:
@@ -151,6 +322,8 @@ class StackAction(BlocksAction):
         ]
 
     def meets_preconditions(self, state) -> bool:
+        if isinstance(state, BlocksState):
+            return self._check_blocks_state(state, self.objects)
         return all([
             state[0] == self.objects[0], # holding the block
             not (stack_index := find_block(self.objects[1], state[1])) is None # destination block exists
@@ -160,6 +333,24 @@ class StackAction(BlocksAction):
     def _apply_in_place(self, state: tuple[str | int, list[list[str | int]]]) -> None:
         state[0] = None # not holding
         state[1][find_block(self.objects[1], state[1])].append(self.objects[0]) # stack on top 
+
+    @staticmethod
+    def _check_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> bool:
+        return state.holding == objects[0] and (location := state.index.get(objects[1])) is not None and len(state.stacks[location[0]]) == location[1] + 1 # holding the block, destination is on top of a stack
+
+    @staticmethod
+    def _get_changed_stack(state: BlocksState, objects: tuple[str | int, ...]) -> str | int | None:
+        return state.index[objects[1]][0]
+
+    @staticmethod
+    def _update_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> None:
+        bottom = state.index[objects[1]][0]
+        stack = state.stacks[bottom]
+        state.index[objects[0]] = (bottom, len(stack))
+        stack.append(objects[0]) # stack on top
+        state.holding = None # not holding
+        state.num_placed += state.goal_below.get(objects[0]) == objects[1]
+        state._hash = None
     
 class UnstackAction(BlocksAction):
     @staticmethod
@@ -178,6 +369,8 @@ class UnstackAction(BlocksAction):
         ]
 
     def meets_preconditions(self, state) -> bool:
+        if isinstance(state, BlocksState):
+            return self._check_blocks_state(state, self.objects)
         return all([
             state[0] is None, # hand empty
             not (stack_index := find_block(self.objects[0], state[1])) is None # top block actually exists
@@ -188,6 +381,19 @@ class UnstackAction(BlocksAction):
     def _apply_in_place(self, state: tuple[str | int, list[list[str | int]]]) -> None:
         state[0] = state[1][find_block(self.objects[0], state[1])].pop() # pops off the block and puts it in holding in one go
 
+    @staticmethod
+    def _check_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> bool:
+        return state.holding is None and (stack := state.stack_of(objects[0])) is not None and len(stack) > 1 and stack[-2] == objects[1] # same checks as the tuple version
 
+    @staticmethod
+    def _get_changed_stack(state: BlocksState, objects: tuple[str | int, ...]) -> str | int | None:
+        return state.index[objects[0]][0]
 
-
+    @staticmethod
+    def _update_blocks_state(state: BlocksState, objects: tuple[str | int, ...]) -> None:
+        stack = state.stack_of(objects[0])
+        top_block = stack.pop() # pops off the top block and puts it in holding
+        del state.index[top_block]
+        state.holding = top_block
+        state.num_placed -= state.goal_below.get(top_block) == stack[-1]
+        state._hash = None
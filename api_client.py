@@ -0,0 +1,71 @@
+import os
+import threading
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+# One pooled OpenAI client for the whole process, so every request reuses kept-alive connections
+# instead of building a new client (and doing a new TLS handshake) per call.
+# The clients pick up `OPENAI_BASE_URL` from the environment like the default ones.
+
+API_KEY_VARIABLE = 'OPENAI_API_KEY_LAB' # replace with however you store your key
+
+CLIENT_SETTINGS = {
+    'max_connections' : 32, # pool size
+    'max_keepalive_connections' : 32,
+    'keepalive_expiry' : 120.0, # seconds an idle connection is kept open
+    'connect_timeout' : 10.0,
+    'timeout' : 900.0, # reading a response, o1 models can take a long time
+    'max_retries' : 2
+}
+
+_client: OpenAI | None = None
+_client_lock = threading.Lock()
+
+def _get_limits_and_timeout() -> tuple[httpx.Limits, httpx.Timeout]:
+    limits = httpx.Limits(
+        max_connections = CLIENT_SETTINGS['max_connections'],
+        max_keepalive_connections = CLIENT_SETTINGS['max_keepalive_connections'],
+        keepalive_expiry = CLIENT_SETTINGS['keepalive_expiry']
+    )
+    return limits, httpx.Timeout(CLIENT_SETTINGS['timeout'], connect = CLIENT_SETTINGS['connect_timeout'])
+
+def configure_client(**settings) -> None:
+    """Updates `CLIENT_SETTINGS` (e.g. `configure_client(max_connections = 64, timeout = 300)`) and closes the current client,
+    so the next `get_client` call builds one with the new settings."""
+    unknown = set(settings) - set(CLIENT_SETTINGS)
+    if unknown:
+        raise ValueError(f'Unknown client settings: {sorted(unknown)}')
+    CLIENT_SETTINGS.update(settings)
+    close_client()
+
+def get_client() -> OpenAI:
+    """Returns the shared client, building it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                limits, timeout = _get_limits_and_timeout()
+                _client = OpenAI(
+                    api_key = os.getenv(API_KEY_VARIABLE),
+                    max_retries = CLIENT_SETTINGS['max_retries'],
+                    http_client = DefaultHttpxClient(limits = limits, timeout = timeout)
+                )
+    return _client
+
+def close_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def new_async_client() -> AsyncOpenAI:
+    """Returns a new async client with the same pool settings.
+    Async connections belong to the event loop they were opened in, so these are made once per `asyncio.run` instead of shared."""
+    limits, timeout = _get_limits_and_timeout()
+    return AsyncOpenAI(
+        api_key = os.getenv(API_KEY_VARIABLE),
+        max_retries = CLIENT_SETTINGS['max_retries'],
+        http_client = DefaultAsyncHttpxClient(limits = limits, timeout = timeout)
+    )
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+
+from openai.types.chat.chat_completion import ChatCompletion
+
+from api_client import get_client
+import response_cache
+
+# OpenAI Batch API - for large sweeps that do not need answers right away (half the price, and no client-side rate limits).
+# A stage writes all of its requests into `{directory}/{stage}_batch_input.jsonl`, submits it, and records the batch id
+# in `{directory}/{stage}_batch.json`. Once the batch is done the output file is downloaded next to it and read back
+# into `{custom_id : (messages, ChatCompletion)}`. The client picks up `OPENAI_BASE_URL`, so this can be pointed at a local stand-in.
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_COMPLETION_WINDOW = '24h'
+BATCH_FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+def get_batch_paths(directory: str, stage: str) -> dict[str, str]:
+    """The files a batch `stage` keeps in `directory` - `input`, `output`, `errors` (JSONL) and `tracking` (batch id etc.)."""
+    return {
+        'input' : f'{directory}/{stage}_batch_input.jsonl',
+        'output' : f'{directory}/{stage}_batch_output.jsonl',
+        'errors' : f'{directory}/{stage}_batch_errors.jsonl',
+        'tracking' : f'{directory}/{stage}_batch.json'
+    }
+
+def write_batch_input(file_path: str, requests: dict[str, list[dict]], model_name: str) -> None:
+    """Writes `{custom_id : messages}` into a batch input file (one chat completion request per line)."""
+    with open(file_path, 'w') as outfile:
+        for custom_id, messages in requests.items():
+            request = {
+                'custom_id' : custom_id,
+                'method' : 'POST',
+                'url' : BATCH_ENDPOINT,
+                'body' : {'model' : model_name, 'messages' : messages}
+            }
+            outfile.write(json.dumps(request) + '\n')
+
+def load_batch_tracking(directory: str, stage: str) -> dict:
+    with open(get_batch_paths(directory, stage)['tracking']) as infile:
+        return json.load(infile)
+
+def _save_batch_tracking(directory: str, stage: str, tracking: dict) -> None:
+    with open(get_batch_paths(directory, stage)['tracking'], 'w') as outfile:
+        json.dump(tracking, outfile)
+
+def submit_batch(directory: str, stage: str, requests: dict[str, list[dict]], model_name: str) -> str:
+    """Writes the input file for `requests` (`{custom_id : messages}`), uploads it and starts the batch. Returns the batch id.
+
+    Refuses to submit a `stage` that already has a tracking file, so the same requests are not paid for twice.
+    """
+    paths = get_batch_paths(directory, stage)
+    if os.path.exists(paths['tracking']):
+        raise FileExistsError(f'ERROR: {paths['tracking']} already exists (batch {load_batch_tracking(directory, stage)['batch_id']}).')
+
+    write_batch_input(paths['input'], requests, model_name)
+    client = get_client()
+    with open(paths['input'], 'rb') as infile:
+        input_file = client.files.create(file = infile, purpose = 'batch')
+    batch = client.batches.create(input_file_id = input_file.id, endpoint = BATCH_ENDPOINT, completion_window = BATCH_COMPLETION_WINDOW)
+
+    _save_batch_tracking(directory, stage, {
+        'batch_id' : batch.id,
+        'input_file_id' : input_file.id,
+        'model' : model_name,
+        'num_requests' : len(requests),
+        'status' : batch.status
+    })
+    print(f'Submitted batch {batch.id} ({len(requests)} requests) for {paths['input']}')
+    return batch.id
+
+def get_batch_status(directory: str, stage: str) -> str:
+    """Fetches the batch status (`validating`, `in_progress`, `completed`, ...) and records it in the tracking file."""
+    tracking = load_batch_tracking(directory, stage)
+    batch = get_client().batches.retrieve(tracking['batch_id'])
+    tracking.update({
+        'status' : batch.status,
+        'output_file_id' : batch.output_file_id,
+        'error_file_id' : batch.error_file_id
+    })
+    _save_batch_tracking(directory, stage, tracking)
+    return batch.status
+
+def wait_for_batch(directory: str, stage: str, *, poll_seconds: float = 60, timeout_seconds: float = None) -> str:
+    """Polls the batch every `poll_seconds` until it reaches a final status (returned), or raises `TimeoutError` after `timeout_seconds`."""
+    start_time = time.monotonic()
+    while (status := get_batch_status(directory, stage)) not in BATCH_FINAL_STATUSES:
+        if timeout_seconds is not None and time.monotonic() - start_time > timeout_seconds:
+            raise TimeoutError(f'Batch for {directory} ({stage}) is still {status} after {timeout_seconds} seconds.')
+        print(f'Batch for {directory} ({stage}) is {status}, checking again in {poll_seconds} seconds.')
+        time.sleep(poll_seconds)
+    return status
+
+def download_batch_results(directory: str, stage: str) -> str:
+    """Downloads the output (and error) file of a finished batch. Returns the output file path."""
+    tracking = load_batch_tracking(directory, stage)
+    if tracking.get('output_file_id') is None:
+        get_batch_status(directory, stage)
+        tracking = load_batch_tracking(directory, stage)
+
+    paths = get_batch_paths(directory, stage)
+    client = get_client()
+    if tracking.get('error_file_id') is not None:
+        with open(paths['errors'], 'w') as outfile:
+            outfile.write(client.files.content(tracking['error_file_id']).text)
+        print(f'WARNING: Batch {tracking['batch_id']} has failed requests, see {paths['errors']}')
+    if tracking.get('output_file_id') is None:
+        raise ValueError(f'Batch {tracking['batch_id']} has no output file (status: {tracking['status']}).')
+
+    with open(paths['output'], 'w') as outfile:
+        outfile.write(client.files.content(tracking['output_file_id']).text)
+    return paths['output']
+
+def read_batch_results(directory: str, stage: str) -> dict[str, tuple[list[dict], ChatCompletion]]:
+    """Reads the downloaded output file into `{custom_id : (messages, response)}`. Failed requests are left out (with a warning).
+    The responses are also added to the response cache, so a later synchronous run of the same request with `use_cache` does not pay for it again."""
+    paths = get_batch_paths(directory, stage)
+    with open(paths['input']) as infile:
+        bodies = {request['custom_id'] : request['body'] for request in map(json.loads, infile)}
+
+    results = {}
+    with open(paths['output']) as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            custom_id, response = result['custom_id'], result.get('response')
+            if result.get('error') is not None or response is None or not response['status_code'] == 200:
+                print(f'WARNING: Batch request {custom_id} failed ({result.get('error') or (response and response['body'])})')
+                continue
+
+            completion = ChatCompletion.model_validate(response['body'])
+            body = bodies[custom_id]
+            results[custom_id] = (body['messages'], completion)
+            if response_cache.RESPONSE_CACHE is not None:
+                response_cache.RESPONSE_CACHE.put(response_cache.ResponseCache.get_key(body['model'], body['messages']), completion)
+
+    missing = set(bodies) - set(results)
+    if missing:
+        print(f'WARNING: {len(missing)} of {len(bodies)} batch requests have no result.')
+    return results
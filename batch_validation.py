@@ -0,0 +1,225 @@
+import numpy as np
+
+from actions import BlocksAction
+from block_code import compile_action, goal_from_state, ACTION_CODES
+
+# Validates many plans at once. States are packed into arrays of block ids (the rank of the block in the goal order,
+# so that in the goal block `i` is on block `i + 1`), and all plans are stepped in lockstep with vectorised precondition masks.
+# Gives the same results as `test_plan`, including the final states (stack order and all).
+
+RESULTS = ('SUCCESS', 'NOTGOAL', 'NOTEXECUTABLE')
+
+TABLE = -1 # `below` value for blocks on the table
+HELD = -2 # `below` value for the block in the hand
+ABSENT = -3 # `below` value for padding blocks
+
+_PICKUP, _PUTDOWN, _STACK, _UNSTACK = (ACTION_CODES[action_class.get_name()] for action_class in BlocksAction.get_actions())
+_PADDING = -2 # action code after the end of a plan (invalid actions are -1)
+
+def _block_names(state: tuple[str | int | None, list[list[str | int]]]) -> list[str | int]:
+    """Returns the blocks of `state` ordered by block id (the goal tower, top -> bottom)."""
+    return goal_from_state(state)[1][0][::-1]
+
+def _pack_states(states: list[tuple[str | int | None, list[list[str | int]]]], names: list[list[str | int]], width: int) -> dict[str, np.ndarray]:
+    """Packs `(holding, [stacks])` states into arrays. Column `width - 1` is a dummy block that unknown objects point to.
+    Values are gathered into flat lists first, numpy only sees them once."""
+    num_states = len(states)
+    rows, blocks, below, bottom_of = [], [], [], []
+    bottom_rows, bottoms, tops, stamps = [], [], [], []
+    hand = [-1] * num_states
+
+    for row, (state, state_names) in enumerate(zip(states, names)):
+        ids = {name : block_id for block_id, name in enumerate(state_names)}
+        if state[0] is not None:
+            hand[row] = ids[state[0]]
+            rows.append(row), blocks.append(ids[state[0]]), below.append(HELD), bottom_of.append(width - 1)
+        for stamp, stack in enumerate(state[1]):
+            stack_ids = [ids[block] for block in stack]
+            rows += [row] * len(stack_ids)
+            blocks += stack_ids
+            below += [TABLE] + stack_ids[:-1]
+            bottom_of += [stack_ids[0]] * len(stack_ids)
+            bottom_rows.append(row), bottoms.append(stack_ids[0]), tops.append(stack_ids[-1]), stamps.append(stamp)
+
+    num_blocks = np.array([len(state_names) for state_names in names], dtype = np.int32)
+    block_ids = np.arange(width)
+    goal_below = np.where(block_ids < num_blocks[:, None] - 1, block_ids + 1, ABSENT).astype(np.int32)
+    goal_below[block_ids == num_blocks[:, None] - 1] = TABLE
+
+    packed = {
+        'below' : np.full((num_states, width), ABSENT, dtype = np.int32),
+        'bottom_of' : np.full((num_states, width), width - 1, dtype = np.int32), # bottom block of the stack a block is in
+        'top_of' : np.full((num_states, width), -1, dtype = np.int32), # top block of the stack with this bottom block
+        'stamp' : np.zeros((num_states, width), dtype = np.int32), # position of the stack with this bottom block in the `[stacks]` list
+        'goal_below' : goal_below,
+        'hand' : np.array(hand, dtype = np.int32),
+        'next_stamp' : np.array([len(state[1]) for state in states], dtype = np.int32),
+        'num_blocks' : num_blocks
+    }
+    packed['below'][rows, blocks] = below
+    packed['bottom_of'][rows, blocks] = bottom_of
+    packed['top_of'][bottom_rows, bottoms] = tops
+    packed['stamp'][bottom_rows, bottoms] = stamps
+    return packed
+
+def _pack_plans(plans: list[list[str]], names: list[list[str | int]], width: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Packs compiled plans into padded `(num_plans, max_length)` matrices of action codes and the block ids of both objects.
+    Objects that are not blocks of the problem point to the dummy block `width - 1`.
+
+    Every distinct action string is only compiled once, the rest of the packing is done with numpy lookups.
+    """
+    dummy = width - 1
+    lengths = np.array([len(plan) for plan in plans], dtype = np.int64)
+    action_index = {}
+    action_ids = np.array([action_index.setdefault(action, len(action_index)) for plan in plans for action in plan], dtype = np.int64)
+
+    vocabulary = {} # object name -> column in `lookup`, the last column is for missing objects
+    unique_codes, unique_objects = [], []
+    for action in action_index:
+        action_code, objects = compile_action(action)
+        unique_codes.append(action_code)
+        unique_objects.append(([vocabulary.setdefault(block, len(vocabulary)) for block in objects] + [-1, -1])[:2])
+
+    lookup = np.full((len(plans), len(vocabulary) + 1), dummy, dtype = np.int32)
+    lookup_rows, lookup_columns, lookup_ids = [], [], []
+    for row, state_names in enumerate(names):
+        for block_id, name in enumerate(state_names):
+            if name in vocabulary:
+                lookup_rows.append(row), lookup_columns.append(vocabulary[name]), lookup_ids.append(block_id)
+    lookup[lookup_rows, lookup_columns] = lookup_ids
+
+    rows = np.repeat(np.arange(len(plans)), lengths)
+    steps = np.arange(len(action_ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    unique_objects = np.array(unique_objects, dtype = np.int64).reshape(-1, 2)
+
+    codes = np.full((len(plans), lengths.max(initial = 0)), _PADDING, dtype = np.int32)
+    first_objects = np.full(codes.shape, dummy, dtype = np.int32)
+    second_objects = np.full(codes.shape, dummy, dtype = np.int32)
+    codes[rows, steps] = np.array(unique_codes, dtype = np.int32).reshape(-1)[action_ids]
+    first_objects[rows, steps] = lookup[rows, unique_objects[action_ids, 0]] # -1 picks the last (missing object) column
+    second_objects[rows, steps] = lookup[rows, unique_objects[action_ids, 1]]
+    return codes, first_objects, second_objects
+
+def _unpack_states(packed: dict[str, np.ndarray], names: list[list[str | int]]) -> list[tuple[str | int | None, list[list[str | int]]]]:
+    """Turns the packed arrays back into the `(holding, [stacks])` format, with the stacks in `test_plan` order."""
+    states = []
+    for below, stamps, hand, state_names in zip(packed['below'].tolist(), packed['stamp'].tolist(), packed['hand'].tolist(), names):
+        above = [-1] * len(state_names)
+        bottoms = []
+        for block, block_below in enumerate(below[:len(state_names)]):
+            if block_below >= 0:
+                above[block_below] = block
+            elif block_below == TABLE:
+                bottoms.append(block)
+
+        stacks = []
+        for bottom in sorted(bottoms, key = stamps.__getitem__):
+            stack = [state_names[bottom]]
+            while (bottom := above[bottom]) != -1:
+                stack.append(state_names[bottom])
+            stacks.append(stack)
+
+        states.append((None if hand == -1 else state_names[hand], stacks))
+    return states
+
+def validate_plans(plans: list[list[str]], states: list[tuple[str | int | None, list[list[str | int]]]], *, track_progress: bool = False) -> dict:
+    """Validates every `plans[i]` against `states[i]` at once (same rules and goal as `test_plan`).
+
+    Returns dict:
+        - `result` is an array of indices into `RESULTS` (SUCCESS, NOTGOAL, NOTEXECUTABLE).
+        - `last_index` is an array with the index of the last action evaluated (`-1` for an empty plan or a state that already is the goal),
+          so for NOTEXECUTABLE plans the last executable action is at `last_index - 1`.
+        - `final_state` is a list of the final states in the `(holding, [stacks])` format.
+        - `goal_distances` (only if `track_progress`) is a `(num_plans, max_length + 1)` array with the number of blocks not on their goal block,
+          for the initial state and after every executed action (`-1` after the plan stopped), as in `test_plan`.
+    """
+    if not len(plans) == len(states):
+        raise ValueError(f'Got {len(plans)} plans for {len(states)} states')
+
+    names = [_block_names(state) for state in states]
+    width = max((len(state_names) for state_names in names), default = 0) + 1
+    packed = _pack_states(states, names, width)
+    codes, first_objects, second_objects = _pack_plans(plans, names, width)
+    below, bottom_of, top_of, stamp, hand = packed['below'], packed['bottom_of'], packed['top_of'], packed['stamp'], packed['hand']
+
+    result = np.full(len(plans), RESULTS.index('NOTGOAL'), dtype = np.int8)
+    last_index = np.array([len(plan) - 1 for plan in plans], dtype = np.int32)
+    num_placed = (below == packed['goal_below']).sum(axis = 1) - (width - packed['num_blocks']) # padding blocks always "match"
+    active = np.ones(len(plans), dtype = bool)
+    if track_progress:
+        goal_distances = np.full((len(plans), codes.shape[1] + 1), -1, dtype = np.int32)
+        goal_distances[:, 0] = packed['num_blocks'] - num_placed
+
+    done = num_placed == packed['num_blocks'] # already at the goal, no action is evaluated
+    result[done] = RESULTS.index('SUCCESS')
+    last_index[done] = -1
+    active[done] = False
+
+    for step in range(codes.shape[1]):
+        rows = np.nonzero(active & (codes[:, step] != _PADDING))[0]
+        if len(rows) == 0:
+            break
+        code, x, y = codes[rows, step], first_objects[rows, step], second_objects[rows, step]
+        hand_empty = hand[rows] == -1
+        x_bottom, y_bottom = bottom_of[rows, x], bottom_of[rows, y]
+        x_stack_top = top_of[rows, x_bottom]
+
+        # preconditions - same as the action classes (including unstack only checking the block under the top block)
+        pickup = (code == _PICKUP) & hand_empty & (below[rows, x] == TABLE) & (top_of[rows, x] == x)
+        putdown = (code == _PUTDOWN) & (hand[rows] == x)
+        stack = (code == _STACK) & (hand[rows] == x) & (below[rows, y] >= TABLE) & (top_of[rows, y_bottom] == y)
+        unstack = (code == _UNSTACK) & hand_empty & (below[rows, x] >= TABLE) & (x_stack_top != x_bottom) & (below[rows, x_stack_top] == y)
+
+        failed = rows[~(pickup | putdown | stack | unstack)]
+        result[failed] = RESULTS.index('NOTEXECUTABLE')
+        last_index[failed] = step
+        active[failed] = False
+
+        r, b = rows[pickup], x[pickup]
+        num_placed[r] -= packed['goal_below'][r, b] == TABLE
+        hand[r], below[r, b], top_of[r, b], bottom_of[r, b] = b, HELD, -1, width - 1
+
+        r, b = rows[putdown], x[putdown]
+        num_placed[r] += packed['goal_below'][r, b] == TABLE
+        hand[r], below[r, b], top_of[r, b], bottom_of[r, b], stamp[r, b] = -1, TABLE, b, b, packed['next_stamp'][r]
+        packed['next_stamp'][r] += 1
+
+        r, b, target, target_bottom = rows[stack], x[stack], y[stack], y_bottom[stack]
+        num_placed[r] += packed['goal_below'][r, b] == target
+        hand[r], below[r, b], bottom_of[r, b], top_of[r, target_bottom] = -1, target, target_bottom, b
+
+        r, b, stack_bottom = rows[unstack], x_stack_top[unstack], x_bottom[unstack]
+        num_placed[r] -= packed['goal_below'][r, b] == below[r, b]
+        top_of[r, stack_bottom] = below[r, b]
+        hand[r], below[r, b], bottom_of[r, b] = b, HELD, width - 1
+
+        if track_progress:
+            executed = rows[active[rows]]
+            goal_distances[executed, step + 1] = packed['num_blocks'][executed] - num_placed[executed]
+
+        done = rows[(num_placed[rows] == packed['num_blocks'][rows]) & active[rows]] # every block sits on its goal block, so the hand is empty too
+        result[done] = RESULTS.index('SUCCESS')
+        last_index[done] = step
+        active[done] = False
+
+    validated = {
+        'result' : result,
+        'last_index' : last_index,
+        'final_state' : _unpack_states(packed, names)
+    }
+    if track_progress:
+        validated['goal_distances'] = goal_distances
+    return validated
+
+def test_plans(plans: list[list[str]], states: list[tuple[str | int | None, list[list[str | int]]]]) -> list[dict]:
+    """Batched `test_plan`, returns one `test_plan` style dict (`result`, `last_action`, `final_state`) per plan.
+    `last_action` is `None` if no action was evaluated (an empty plan, or the state already is the goal)."""
+    validated = validate_plans(plans, states)
+    return [
+        {
+            'result' : RESULTS[result],
+            'last_action' : plan[last_index] if last_index >= 0 else None,
+            'final_state' : final_state
+        }
+        for plan, result, last_index, final_state in zip(plans, validated['result'].tolist(), validated['last_index'].tolist(), validated['final_state'])
+    ]
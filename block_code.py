@@ -1,84 +1,306 @@
-from copy import deepcopy
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable
 
-from actions import BlocksAction
+from actions import BlocksAction, BlocksState
+
+# block names - bijective base 26 over a...z, so 0...25 -> a...z, 26 -> aa, 27 -> ab, ..., 701 -> zz, 702 -> aaa.
+# Shorter names come first and names of the same length are in alphabetical order, 
+# so ordering names by `(len(name), name)` is the same as ordering the ints.
+# Every one and two letter name is in a lookup table, longer ones are converted with arithmetic.
+_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+def _int_to_name(my_int: int) -> str:
+    name, remainder = '', my_int + 1
+    while remainder > 0:
+        remainder, letter = divmod(remainder - 1, 26)
+        name = _LETTERS[letter] + name
+    return name
+
+def _name_to_int(name: str) -> int:
+    my_int = 0
+    for letter in name:
+        my_int = my_int * 26 + ord(letter) - ord('a') + 1
+    return my_int - 1
+
+BLOCK_NAMES: list[str] = [_int_to_name(my_int) for my_int in range(26 + 26 ** 2)]
+BLOCK_IDS: dict[str, int] = {name : my_int for my_int, name in enumerate(BLOCK_NAMES)}
+
+def block_sort_key(block: str | int) -> int | tuple[int, str]:
+    """Sort key for blocks that puts names in the same order as the ints they stand for."""
+    return (len(block), block) if isinstance(block, str) else block
 
 def goal_from_state(state: tuple[int, list[list[int]]]) -> tuple[int, list[list[int]]]:
     return (None, 
             [sorted(
-                sum(state[1], []) + ([] if state[0] is None else [state[0]]), 
+                [block for stack in state[1] for block in stack] + ([] if state[0] is None else [state[0]]), 
+                key = block_sort_key,
                 reverse = True
             )]
         )
 
 def int_to_char(my_int: int) -> str:
-    """Takes an int 0...25 and returns the corresponding lower case char"""
-    if not -1 < my_int < 26:
+    """Takes an int 0, 1, ... and returns the corresponding block name (a...z, then aa, ab, ...)"""
+    if my_int < 0:
         raise ValueError(f'int out of bounds: {my_int}')
-    
-    return chr(my_int + ord('a'))
+    return BLOCK_NAMES[my_int] if my_int < len(BLOCK_NAMES) else _int_to_name(my_int)
 
 def int_state_to_char(state: tuple[int, list[list[int]]]) -> tuple[str, list[list[str]]]:
-    """Turns a state of ints into a state of chars 0...n -> a...z"""
+    """Turns a state of ints into a state of block names 0...n -> a, b, ..., aa, ab, ..."""
     return [None if state[0] is None else int_to_char(state[0]), [[int_to_char(block) for block in stack] for stack in state[1]]]
 
 def char_to_int(my_char: str) -> int:
-    """Takes an char a...z and returns the corresponding int"""
+    """Takes a block name (a...z, aa, ab, ...) and returns the corresponding int"""
     my_char = my_char.lower()
-    if not len(my_char) == 1 and ord('a') <= ord(my_char) <= ord('z'):
-        raise ValueError(f'Invalid char: {my_char}')
-    
-    return ord(my_char) - ord('a')
+    my_int = BLOCK_IDS.get(my_char)
+    if my_int is None:
+        if not (my_char.isascii() and my_char.isalpha()):
+            raise ValueError(f'Invalid block name: {my_char}')
+        my_int = _name_to_int(my_char)
+    return my_int
 
 def char_state_to_int(state: tuple[str, list[list[str]]]) -> tuple[int, list[list[int]]]:
-    """Turns a state of ints into a state of chars a...z -> 0...n"""
+    """Turns a state of block names into a state of ints a, b, ..., aa, ab, ... -> 0...n"""
     return [None if state[0] is None else char_to_int(state[0]), [[char_to_int(block) for block in stack] for stack in state[1]]]
 
+def generate_optimal_plan(state: tuple[str | int | None, list[list[str | int]]]) -> list[str]:
+    """Returns an optimal plan (list of `(action object object ...)` strings) from `state` to the `goal_from_state` tower, in O(n).
+    Its length is `get_solution_length` (from generate_problem_sets.py). The hand has to be empty.
+
+    Clears the main tower (the one on the goal bottom block) down to its correct prefix, then places the goal blocks 
+    bottom -> top, moving whatever sits on top of the next block to the table first. 
+    Every block is moved to the table at most once, so each block is touched O(1) times.
+    """
+    if state[0] is not None:
+        raise ValueError(f'Can only generate a plan with an empty hand, holding: {state[0]}')
+
+    goal = goal_from_state(state)[1][0]
+    if len(goal) == 0:
+        return []
+
+    stacks = [list(stack) for stack in state[1] if len(stack) > 0]
+    stack_of = {block : stack for stack in stacks for block in stack} # shared lists, so moving a block is one entry
+    plan = []
+
+    def move_to_table(stack: list[str | int]):
+        block = stack.pop()
+        plan.append(f'(unstack {block} {stack[-1]})')
+        plan.append(f'(putdown {block})')
+        stack_of[block] = [block]
+
+    num_placed = 0
+    main_tower = stack_of[goal[0]]
+    if main_tower[0] == goal[0]:
+        while num_placed < len(main_tower) and main_tower[num_placed] == goal[num_placed]:
+            num_placed += 1
+        while len(main_tower) > num_placed:
+            move_to_table(main_tower)
+
+    for index in range(num_placed, len(goal)):
+        block = goal[index]
+        stack = stack_of[block]
+        while not stack[-1] == block: # everything above is below `block` in the goal, so it has to move twice anyway
+            move_to_table(stack)
+
+        if len(stack) == 1:
+            plan.append(f'(pickup {block})')
+        else:
+            stack.pop()
+            plan.append(f'(unstack {block} {stack[-1]})')
+
+        if index == 0: # the goal bottom block was not on the table
+            plan.append(f'(putdown {block})')
+            stack_of[block] = [block]
+        else:
+            plan.append(f'(stack {block} {goal[index - 1]})')
+            tower = stack_of[goal[index - 1]]
+            tower.append(block)
+            stack_of[block] = tower
+
+    return plan
+
 def state_to_pddl(state: tuple[str | int, list[list[str | int]]], is_goal = False) -> list[str]:
     """
     Turns char or int BlocksWorld state into pddl form (list of strings, with brackets). 
     `is_goal` turns the state into a partial goal state (instead of a complete state decription)
+
+    Single pass over the blocks - each predicate list is built with appends and joined once.
     """
-    pddl = {
-        'holding' : [] if (state[0] is None or is_goal) else [str(state[0])],
-        'clear' : [],
-        'on' : [],
-        'ontable' : []
-    }
+    holding, clear, on, ontable = [], [], [], []
+    if not (state[0] is None or is_goal):
+        holding.append(f'(holding {state[0]})')
     for stack in state[1]:
         if not is_goal:
-            pddl['clear'].append(str(stack[-1]))
-            pddl['ontable'].append(str(stack[0]))
-        pddl['on'] += [f'{x} {y}' for x, y in zip(stack[1:], stack[:-1])][::-1]
+            clear.append(f'(clear {stack[-1]})')
+            ontable.append(f'(ontable {stack[0]})')
+        on.extend(f'(on {stack[height]} {stack[height - 1]})' for height in range(len(stack) - 1, 0, -1)) # top -> bottom
     
-    return (['(handempty)'] if (state[0] is None and not is_goal) else []) + sum([[f'({key} {objects})' for objects in pddl[key]] for key in pddl.keys()], [])
+    return (['(handempty)'] if (state[0] is None and not is_goal) else []) + holding + clear + on + ontable
+
+# compiled plans - every action string is parsed once into an interned `(action_code, (object, ...))` tuple,
+# where `action_code` indexes into `ACTION_HANDLERS`. Unparseable actions compile to `INVALID_ACTION`.
+ACTION_CODES: dict[str, int] = {action_class.get_name() : code for code, action_class in enumerate(BlocksAction.get_actions())}
+ACTION_HANDLERS: list[Callable[[BlocksState, tuple[str | int, ...]], bool]] = [action_class.try_apply_in_place for action_class in BlocksAction.get_actions()]
+_ACTION_CLASSES: list[type[BlocksAction]] = BlocksAction.get_actions()
+_ACTION_NUM_OBJECTS: list[int] = [action_class.get_num_objects() for action_class in BlocksAction.get_actions()]
+INVALID_ACTION: tuple[int, tuple] = (-1, ())
+
+@lru_cache(maxsize = 1 << 16)
+def compile_action(action: str) -> tuple[int, tuple[str | int, ...]]:
+    """Parses a `(action object object ...)` string into `(action_code, (object, ...))`, or `INVALID_ACTION` if it cannot be applied to any state.
+    Results are cached, so repeated action strings share the same tuple."""
+    tokens = action[1:-1].split()
+    if len(tokens) == 0:
+        return INVALID_ACTION
+
+    action_code = ACTION_CODES.get(tokens[0])
+    if action_code is None or not len(tokens) - 1 == _ACTION_NUM_OBJECTS[action_code]:
+        return INVALID_ACTION
+
+    return (action_code, tuple(int(block) if block.isnumeric() else sys.intern(block) for block in tokens[1:]))
+
+def compile_plan(plan: list[str]) -> list[tuple[int, tuple[str | int, ...]]]:
+    """Compiles a plan (list of `(action object object ...)` strings) into a list of `(action_code, (object, ...))` tuples."""
+    return [compile_action(action) for action in plan]
 
-def apply_action(action: str, state: tuple[str | int, list[list[str | int]]]) -> tuple[bool, tuple[str | int, list[list[str | int]]]]:
-    """Applies action out of place. Works for int or str states.
+def _apply_compiled_action(compiled_action: tuple[int, tuple[str | int, ...]], state: BlocksState) -> BlocksState | None:
+    """Applies a compiled action out of place. Returns the new state, or None if the action is not applicable."""
+    action_code, objects = compiled_action
+    return None if action_code < 0 else _ACTION_CLASSES[action_code].try_apply(state, objects)
+
+def run_compiled_plan(compiled_plan: list[tuple[int, tuple[str | int, ...]]], state: BlocksState, goal_distances: list[int] = None) -> tuple[str, int, BlocksState]:
+    """Runs a compiled plan from `state` (built with its goal, `BlocksState.from_tuple(state, goal)`) until it reaches the goal or an action is not executable.
+    The goal check is the state's placed-blocks counter, not a full state comparison. 
+    `state` is copied once and the actions change the copy in place, so every step is O(1).
+
+    Returns `(result, last_index, final_state)`, with `result` as in `test_plan` and `last_index` the index of the last action evaluated
+    (-1 if none was, for an empty plan or a `state` that already is the goal).
+    If `goal_distances` is a list, the goal distance of the initial state and of the state after every executed action is appended to it.
+    """
+    state = state.copy()
+    num_goal_blocks = len(state.goal_below)
+    if goal_distances is not None:
+        goal_distances.append(num_goal_blocks - state.num_placed)
+    if state.num_placed == num_goal_blocks:
+        return 'SUCCESS', -1, state
+
+    last_index = -1
+    for last_index, (action_code, objects) in enumerate(compiled_plan):
+        if action_code < 0 or not ACTION_HANDLERS[action_code](state, objects):
+            return 'NOTEXECUTABLE', last_index, state
+        if goal_distances is not None:
+            goal_distances.append(num_goal_blocks - state.num_placed)
+        if state.num_placed == num_goal_blocks:
+            return 'SUCCESS', last_index, state
+    return 'NOTGOAL', last_index, state
+
+def apply_action(action: str, state: tuple[str | int, list[list[str | int]]] | BlocksState) -> tuple[bool, tuple[str | int, list[list[str | int]]] | BlocksState]:
+    """Applies action out of place. Works for int or str states, in the tuple format or as a `BlocksState`.
     
     Returns
         - **(True, new_state)** if action is possible.
         - **(False, old_state)** otherwise
     """
-    try:
-        tokens = action[1:-1].split()
-        action_list = [int(block) if block.isnumeric() else block for block in tokens[1:]]
-        action_tag = tokens[0]
-    except IndexError:
-        return False, state
-    
-    ActionClass = next((ac for ac in BlocksAction.get_actions() if ac.get_name() == action_tag), None)
+    if isinstance(state, BlocksState):
+        new_state = _apply_compiled_action(compile_action(action), state)
+        return (False, state) if new_state is None else (True, new_state)
 
-    try:
-        action: BlocksAction = ActionClass(action_list)
-    except (TypeError, ValueError):
-        return False, state
+    new_state = _apply_compiled_action(compile_action(action), BlocksState.from_tuple(state))
+    return (False, state) if new_state is None else (True, new_state.to_tuple())
 
-    if action.meets_preconditions(state):
-        return (True, action.apply_to_state(state))
-    else:
-        return False, state
+def apply_action_in_place(action: str, state: BlocksState) -> bool:
+    """Applies action to a `BlocksState` in place. Returns whether it was applied (`state` is unchanged otherwise)."""
+    action_code, objects = compile_action(action)
+    return action_code >= 0 and ACTION_HANDLERS[action_code](state, objects)
             
-def test_plan(plan: list[str], state: tuple[str | int, list[list[str | int]]]) -> dict:
+class _PrefixNode:
+    """Trie node for a validated plan prefix. `state` is the state after the prefix, or None if its last action is not executable.
+    `key` is the compiled action leading to the node (the problem key for roots)."""
+    __slots__ = ('state', 'is_goal', 'children', 'parent', 'key')
+
+    def __init__(self, state: BlocksState | None, is_goal: bool, parent: '_PrefixNode | None', key):
+        self.state = state
+        self.is_goal = is_goal
+        self.children: dict[tuple[int, tuple[str | int, ...]], _PrefixNode] = {}
+        self.parent = parent
+        self.key = key
+
+class PlanPrefixCache:
+    """Per-problem tries of validated plan prefixes, with the intermediate state stored at every node.
+    A plan resumes from its deepest cached prefix, so re-validating plans that share prefixes (e.g. across error correction rounds)
+    only costs as much as their new suffixes. Non-executable actions are cached too.
+
+    Holds at most `max_nodes` nodes (roots included), evicting the least recently used ones.
+    Every lookup touches its path deepest node first, so ancestors are always more recent than their descendants 
+    and the evicted node is always a leaf.
+    """
+    def __init__(self, max_nodes: int = 100_000):
+        if max_nodes < 1:
+            raise ValueError(f'max_nodes must be positive, got {max_nodes}')
+        self.max_nodes = max_nodes
+        self.hits = 0 # actions resumed from the trie
+        self.misses = 0 # actions that had to be applied
+        self._roots: dict[tuple, _PrefixNode] = {} # problem key -> root
+        self._lru: OrderedDict[_PrefixNode, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def clear(self):
+        self._roots.clear()
+        self._lru.clear()
+
+    def _get_root(self, state: tuple[str | int | None, list[list[str | int]]]) -> _PrefixNode:
+        # keyed on the exact state (stack order included), so cached final states match `test_plan`
+        problem_key = (state[0], tuple(tuple(stack) for stack in state[1]))
+        root = self._roots.get(problem_key)
+        if root is None:
+            root_state = BlocksState.from_tuple(state, goal_from_state(state))
+            root = self._roots[problem_key] = _PrefixNode(root_state, root_state.is_goal(), None, problem_key)
+            self._lru[root] = None
+        return root
+
+    def _evict(self):
+        while len(self._lru) > self.max_nodes:
+            node, _ = self._lru.popitem(last = False)
+            if node.parent is None:
+                del self._roots[node.key]
+            else:
+                del node.parent.children[node.key]
+
+    def run_compiled_plan(self, compiled_plan: list[tuple[int, tuple[str | int, ...]]], state: tuple[str | int | None, list[list[str | int]]], goal_distances: list[int] = None) -> tuple[str, int, BlocksState]:
+        """Same as `run_compiled_plan` from `state` to its goal, but resuming from (and extending) the trie."""
+        node = self._get_root(state)
+        path = [node]
+        result, last_index = ('SUCCESS' if node.is_goal else 'NOTGOAL'), -1
+        for last_index, compiled_action in enumerate(() if node.is_goal else compiled_plan):
+            child = node.children.get(compiled_action)
+            if child is None:
+                next_state = _apply_compiled_action(compiled_action, node.state)
+                child = node.children[compiled_action] = _PrefixNode(next_state, next_state is not None and next_state.is_goal(), node, compiled_action)
+                self._lru[child] = None
+                self.misses += 1
+            else:
+                self.hits += 1
+            path.append(child)
+
+            if child.state is None:
+                result = 'NOTEXECUTABLE'
+                break
+            node = child
+            if node.is_goal:
+                result = 'SUCCESS'
+                break
+
+        for path_node in reversed(path):
+            self._lru.move_to_end(path_node)
+        if goal_distances is not None:
+            goal_distances += [path_node.state.goal_distance for path_node in path if path_node.state is not None]
+        self._evict()
+        return result, last_index, node.state
+
+def test_plan(plan: list[str], state: tuple[str | int, list[list[str | int]]], cache: PlanPrefixCache = None, *, track_progress: bool = False) -> dict:
     """
     **plan** is list of `(action object object ...)` strings
     
@@ -89,8 +311,13 @@ def test_plan(plan: list[str], state: tuple[str | int, list[list[str | int]]]) -
             - SUCCESS if plan reaches goal successfully.
             - NOTGOAL if the plan is executable but does not reach a goal state
             - NOTEXECUTABLE if the plan is not executable
-        - `last_action` is the last action evaluated.
+        - `last_action` is the last action evaluated, None if there is none (an empty plan, or `state` already is the goal).
         - `final_state` is the final state after running the plan until the first non-exec action.
+
+        - `goal_distances` (only if `track_progress`) is the number of blocks not on their goal block,
+          for the initial state and after every executed action.
+
+    Pass a `PlanPrefixCache` as `cache` to resume from previously validated prefixes of plans for the same state.
     """
     def to_dict(result: str, last_action: str, final_state: tuple[str | int, list[list[str | int]]]) -> dict:
         return {
@@ -99,15 +326,13 @@ def test_plan(plan: list[str], state: tuple[str | int, list[list[str | int]]]) -
             'final_state' : final_state
         }
 
-    current_state = deepcopy(state)
-    goal = goal_from_state(state)
-
-    for action in plan:
-        check, current_state = apply_action(action, current_state)
-        if not check:
-            return to_dict('NOTEXECUTABLE', action, current_state)
-        if current_state == goal:
-            return to_dict('SUCCESS', action, current_state)
+    goal_distances = [] if track_progress else None
+    if cache is None:
+        result, last_index, final_state = run_compiled_plan(compile_plan(plan), BlocksState.from_tuple(state, goal_from_state(state)), goal_distances)
     else:
-        return to_dict('NOTGOAL', action, current_state)
-                       
\ No newline at end of file
+        result, last_index, final_state = cache.run_compiled_plan(compile_plan(plan), state, goal_distances)
+
+    result_dict = to_dict(result, plan[last_index] if last_index >= 0 else None, final_state.to_tuple())
+    if track_progress:
+        result_dict['goal_distances'] = goal_distances
+    return result_dict
\ No newline at end of file
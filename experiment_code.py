@@ -1,39 +1,82 @@
 import os
 import re
 import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Callable
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from openai.types.chat.chat_completion import ChatCompletion
 
+from api_client import get_client, new_async_client
+import response_cache
+import rate_limiter
 from prompts import *
-from block_code import test_plan, int_state_to_char
+from block_code import test_plan, int_state_to_char, apply_action_in_place, goal_from_state, BlocksState
+from actions import BlocksAction
 
 # TODO - this is new!
-def make_directory(dir_name: str) -> bool:
-    """Creates the last directory in the dirpath. Will abort if the parent dir does not exist or `dir_name` already exists."""
+def make_directory(dir_name: str, *, resume: bool = False) -> bool:
+    """Creates the last directory in the dirpath. Will abort if the parent dir does not exist or `dir_name` already exists 
+    (unless `resume`, in which case the existing directory is used)."""
     try:
         os.mkdir(dir_name)
     except FileNotFoundError:
         print(f'Only the top directory is created automatically (`{dir_name}` is invalid).')
         return False
     except FileExistsError:
+        if resume:
+            print(f'Directory {dir_name} already exists. Resuming.')
+            return True
         print(f'Directory {dir_name} already exists. Aborting.')
         return False
     
     return True
 
 
-def get_response(client: OpenAI, messages: dict, model_name: str) -> ChatCompletion:
-    """Returns an OpenAI ChatCompletion object in response to a messages dict input (see OpenAI docs for more info)"""
+def _get_cached_response(messages: dict, model_name: str, use_cache: bool, params: dict = None) -> tuple[ChatCompletion | None, str | None]:
+    """Returns `(cached response or None, cache key or None if the cache is not used)`. 
+    `params` are the extra request parameters (part of the key)."""
+    cache = response_cache.RESPONSE_CACHE
+    if cache is None:
+        return None, None
+    if not use_cache:
+        cache.bypassed += 1
+        return None, None
+    key = cache.get_key(model_name, messages, params)
+    return cache.get(key), key
+
+def _cache_response(key: str | None, response: ChatCompletion) -> None:
+    if key is not None and response_cache.RESPONSE_CACHE is not None:
+        response_cache.RESPONSE_CACHE.put(key, response)
+
+def get_response(client: OpenAI, messages: dict, model_name: str, *, use_cache: bool = False) -> ChatCompletion:
+    """Returns an OpenAI ChatCompletion object in response to a messages dict input (see OpenAI docs for more info)
+    
+    Requests are sent through `rate_limiter.RATE_LIMITER` (per model budgets, retries with backoff).
+    With `use_cache`, responses go through `response_cache.RESPONSE_CACHE`, so the same request is only sent once. 
+    It is off by default, as most requests are samples and running an experiment again should draw new ones - it is meant for 
+    the summary calls, and for picking a crashed sweep back up on purpose.
+    """
     # messages = [{'role': 'user', 'content': [ {'type': 'text', 'text': user_text} ]}]
-    response = client.chat.completions.create(
-        model = model_name,
-        messages = messages
-    )
+    response, key = _get_cached_response(messages, model_name, use_cache)
+    if response is not None:
+        return response
+
+    if rate_limiter.RATE_LIMITER is not None:
+        response = rate_limiter.RATE_LIMITER.create_completion(client, messages, model_name)
+    else:
+        response = client.chat.completions.create(
+            model = model_name,
+            messages = messages
+        )
+    _cache_response(key, response)
 
     return response
 
-def generate_response_file(file_path: str, messages: dict, model_name: str) -> None:
+def generate_response_file(file_path: str, messages: dict, model_name: str, *, use_cache: bool = False) -> None:
     # TODO - this needs testing for sure - major change.
     """
     Saves the messages dict and response info in `.json` format to `file_path`.
@@ -54,9 +97,13 @@ def generate_response_file(file_path: str, messages: dict, model_name: str) -> N
         - input_tokens
         - reasoning_tokens
     """
-    client = OpenAI(api_key = os.getenv('OPENAI_API_KEY_LAB')) # replace with however you store your key
-    response = get_response(client, messages, model_name)
+    client = get_client() # shared, pooled client (see api_client.py)
+    response = get_response(client, messages, model_name, use_cache = use_cache)
+    save_response_file(file_path, messages, response)
 
+def save_response_file(file_path: str, messages: dict, response: ChatCompletion, *, early_stop: dict = None) -> None:
+    """Saves the messages dict and the response in the `generate_response_file` format.
+    `early_stop` is added to the response for streamed responses that were stopped early (see `get_streamed_response`)."""
     # I only keep the parts of the response that I personally care about. 
     # If you need to get at/store more information this is the place to do that. 
 
@@ -70,8 +117,87 @@ def generate_response_file(file_path: str, messages: dict, model_name: str) -> N
             'reasoning_tokens' : response.usage.completion_tokens_details.reasoning_tokens
         }
     }
-    with open(file_path, 'w') as save_file:
+    if early_stop is not None:
+        save_dict['response']['early_stop'] = early_stop
+    with open(f'{file_path}.tmp', 'w') as save_file:
         json.dump(save_dict, save_file)
+    os.replace(f'{file_path}.tmp', file_path) # a response file either exists complete or not at all, so resumed runs can skip it
+
+# async mode - many requests in flight at once, at most `max_concurrency` of them. 
+# The clients pick up `OPENAI_BASE_URL` from the environment, so this can be pointed at a local stand-in server.
+
+async def get_response_async(client: AsyncOpenAI, messages: dict, model_name: str, *, use_cache: bool = False) -> ChatCompletion:
+    """Async version of `get_response` (same cache)."""
+    response, key = _get_cached_response(messages, model_name, use_cache)
+    if response is not None:
+        return response
+
+    if rate_limiter.RATE_LIMITER is not None:
+        response = await rate_limiter.RATE_LIMITER.create_completion_async(client, messages, model_name)
+    else:
+        response = await client.chat.completions.create(
+            model = model_name,
+            messages = messages
+        )
+    _cache_response(key, response)
+    return response
+
+def _run_async(coroutine):
+    """`asyncio.run`, in a worker thread if this thread already runs an event loop (e.g. in Jupyter), 
+    so the async entry points can be called like any other function."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coroutine).result()
+
+async def _generate_response_files_async(jobs: list[tuple], model_name: str, max_concurrency: int, stream: bool, use_cache: bool) -> list[str]:
+    client = new_async_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    failed = []
+    num_done = 0
+
+    async def generate(file_path: str, messages: dict, state: tuple = None):
+        nonlocal num_done
+        early_stop = None
+        async with semaphore:
+            try:
+                if stream:
+                    response, early_stop = await get_streamed_response_async(client, messages, model_name, state, use_cache = use_cache)
+                else:
+                    response = await get_response_async(client, messages, model_name, use_cache = use_cache)
+            except Exception as error: # one bad request should not take down the rest of the round
+                print(f'WARNING: Request for {file_path} failed ({type(error).__name__}: {error})')
+                failed.append(file_path)
+                return
+        save_response_file(file_path, messages, response, early_stop = early_stop) # written as soon as it completes
+        num_done += 1
+        print(f'Saved response file {num_done}/{len(jobs)} to {file_path}' + ('' if early_stop is None else f' (stopped early: {early_stop['result']})'))
+
+    async with client:
+        await asyncio.gather(*(generate(*job) for job in jobs))
+    return failed
+
+def generate_response_files_async(
+        jobs: list[tuple], 
+        model_name: str, 
+        *, 
+        max_concurrency: int = 8, 
+        stream: bool = False, 
+        use_cache: bool = False
+    ) -> list[str]:
+    """Generates a response file (see `generate_response_file`) for every `(file_path, messages)` in `jobs`, 
+    with up to `max_concurrency` requests in flight. Files are written as the responses come in.
+
+    With `stream`, the jobs are blocksworld tasks `(file_path, messages, state)` and are streamed (see `get_streamed_response`).
+    `use_cache` as in `get_response`.
+
+    Returns the file paths of the requests that failed (these files are not written).
+    """
+    if max_concurrency < 1:
+        raise ValueError(f'max_concurrency must be at least 1, got {max_concurrency}')
+    return _run_async(_generate_response_files_async(jobs, model_name, max_concurrency, stream, use_cache))
 
 def generate_general_strategy(strategy_prompt: str, target_dir: str, strategy_num: int, model_name: str):
     """Generates a strategy to `target_dir`."""
@@ -97,12 +223,91 @@ def parse_pddl_text(text: str) -> list[str]:
     return action_list
 
 
-def generate_blocksworld_solution_summary(response_file_path: str, summary_model: str) -> dict:
+# Local plan extraction - many responses already contain a clean plan (one action per line), which can be taken straight from 
+# the text instead of asking the summary model. Anything unclear is left to the summary model.
+
+BLOCKSWORLD_ACTION_ARITIES = {action.get_name() : action.get_num_objects() for action in BlocksAction.get_actions()}
+
+_PDDL_ACTION = re.compile(r'\(\s*([a-z]+)((?:\s+[a-z]+)*)\s*\)')
+_LIST_MARKER = re.compile(r'^(?:\d+\s*[.):]|[-*\u2022]|step\s*\d+\s*[.:)]?)\s*', re.IGNORECASE) # `1.`, `2)`, `-`, `*`, `Step 3:`
+
+def _to_blocksworld_action(name: str, arguments: str) -> str | None:
+    """`(name argument ...)`, or None if `name` is not a BlocksWorld action or has the wrong number of arguments."""
+    arguments = arguments.split()
+    if not BLOCKSWORLD_ACTION_ARITIES.get(name) == len(arguments):
+        return None
+    return f'({name} {' '.join(arguments)})'
+
+def _parse_action_line(line: str, *, allow_note: bool = False) -> str | None:
+    """Returns the action if `line` is a single action (list markers, backticks and bold around it are allowed), otherwise None.
+    With `allow_note`, the action can also be followed by a note (`; ...` comments, or text that does not mention another action)."""
+    line = _LIST_MARKER.sub('', line.strip(), count = 1).strip().strip('`*').strip()
+    match = _PDDL_ACTION.fullmatch(line)
+    if match is None and allow_note:
+        match = _PDDL_ACTION.match(line)
+        if match is not None:
+            note = line[match.end():].lstrip('`* \u2003').replace('&nbsp;', '').strip()
+            if not note.startswith(';') and _PDDL_ACTION.search(note) is not None:
+                match = None
+    return None if match is None else _to_blocksworld_action(match.group(1), match.group(2))
+
+def extract_pddl_plan(response_text: str) -> list[str] | None:
+    """Finds the plan in a response without the summary model. Returns None if it is not clear what the plan is.
+
+    Candidates are runs of 2+ consecutive lines that each hold a single action (blank lines are allowed inside code blocks). 
+    The plan is used if
+        - all candidates are the same plan, or only one distinct plan is inside a code block, and
+        - every action mentioned anywhere in the text (e.g. in the explanation) is part of that plan - so drafts and partial plans
+        are left to the summary model.
+    """
+    runs = [] # (actions, in code block)
+    run, in_code_block = [], False
+    for line in response_text.split('\n'):
+        if line.strip().startswith('```'):
+            if run:
+                runs.append((run, in_code_block))
+                run = []
+            in_code_block = not in_code_block
+            continue
+
+        action = _parse_action_line(line)
+        if action is not None:
+            run.append(action)
+        elif run and not (in_code_block and line.strip() == ''):
+            runs.append((run, in_code_block))
+            run = []
+    if run:
+        runs.append((run, in_code_block))
+
+    candidates = {tuple(actions) for actions, _ in runs if len(actions) > 1}
+    if len(candidates) > 1:
+        candidates = {tuple(actions) for actions, in_code_block in runs if len(actions) > 1 and in_code_block}
+    if not len(candidates) == 1:
+        return None
+    
+    plan = list(candidates.pop())
+    plan_actions = set(plan)
+    for match in _PDDL_ACTION.finditer(response_text):
+        action = _to_blocksworld_action(match.group(1), match.group(2))
+        if action is not None and action not in plan_actions:
+            return None # some other action is mentioned too
+    return plan
+
+def get_blocksworld_summary_messages(response_text: str) -> list[dict]:
+    """Returns the messages for summarising a blocksworld solution into PDDL actions."""
+    return [
+        {"role": "assistant", "content": [{"text": response_text, "type": "text"}]},
+        {'role': 'user', 'content': [{'text': BLOCKSWORLD_SUMMARY_PROMPT, 'type': 'text'}]}
+    ]
+
+def generate_blocksworld_solution_summary(response_file_path: str, summary_model: str, *, local_extraction: bool = True) -> dict:
     """Takes a .json filepath as input, with the input messages and response data inside the file. 
     Returns a dictionary with list of BlocksWorld PDDL actions from the solution in the ChatCompletion (`solution`), 
-    and the model used to create the initial (pre-summary) solution (`model_used`)."""
-
-    client = OpenAI(api_key = os.getenv('OPENAI_API_KEY_LAB')) # replace with however you store your key
+    the model used to create the initial (pre-summary) solution (`model_used`), and how the solution was extracted 
+    (`extraction` - `local` if `extract_pddl_plan` found it, `stream` if the response was stopped early while it was streamed 
+    (the committed plan it was stopped on), otherwise `summary_model`).
+    
+    Set `local_extraction` to False to always use the summary model."""
 
     with open(response_file_path, 'r') as load_file: 
         response_data = json.load(load_file)
@@ -110,28 +315,46 @@ def generate_blocksworld_solution_summary(response_file_path: str, summary_model
     response_text = response_data['response']['content']
     model_used = response_data['response']['model']
 
-    messages = [
-        {"role": "assistant", "content": [{"text": response_text, "type": "text"}]},
-        {'role': 'user', 'content': [{'text': BLOCKSWORLD_SUMMARY_PROMPT, 'type': 'text'}]}
-    ]
+    early_stop = response_data['response'].get('early_stop')
+    if early_stop is not None:
+        return {
+            'model_used' : model_used,
+            'solution' : early_stop['plan'],
+            'extraction' : 'stream'
+        }
+
+    solution = extract_pddl_plan(response_text) if local_extraction else None
+    if solution is not None:
+        return {
+            'model_used' : model_used,
+            'solution' : solution,
+            'extraction' : 'local'
+        }
+
+    client = get_client() # shared, pooled client (see api_client.py)
+    messages = get_blocksworld_summary_messages(response_text)
 
-    summary: ChatCompletion = get_response(client, messages, summary_model)
+    summary: ChatCompletion = get_response(client, messages, summary_model, use_cache = True)
     solution = parse_pddl_text(summary.choices[0].message.content)
 
     return {
         'model_used' : model_used,
-        'solution' : solution
+        'solution' : solution,
+        'extraction' : 'summary_model'
     }
 
-def evaluate_blocksworld_solution(problem: dict, solution: list[str], model_used: str):
-    """Evaluates the list of actions in solution `solution` as a solution to the state in `problem`. Returns the full `dict` for forming `solution_results.json`"""
+def evaluate_blocksworld_solution(problem: dict, solution: list[str], model_used: str, test_result: dict = None):
+    """Evaluates the list of actions in solution `solution` as a solution to the state in `problem`. Returns the full `dict` for forming `solution_results.json`
+
+    `test_result` can be passed in if the plan was already validated (e.g. by `batch_validation.test_plans`).
+    """
     state = int_state_to_char((None, problem['state']))
     result_entry = {
         'problem_data' : problem,
         'result_data' : {
             'solution' : solution, # list[str]
             'solution_length': len(solution), # int
-            'test_result' : test_plan(solution, state), # dict - result, last_action, final_state
+            'test_result' : test_plan(solution, state) if test_result is None else test_result, # dict - result, last_action, final_state
         }
     }
 
@@ -145,11 +368,239 @@ def generate_blocksworld_strategy(target_dir: str, strategy_num: int, model_name
     generate_general_strategy(BLOCKSWORLD_STRATEGY_PROMPT, target_dir, strategy_num, model_name)
 
 
-def generate_initial_blocksworld_solution(state: tuple[str | int | None, list[list[str | int]]], strategy: str, file_path: str, model_name: str):
-    """Generates a response file for a given blocksworld tasks to the `file_path`"""
+def get_initial_blocksworld_messages(state: tuple[str | int | None, list[list[str | int]]], strategy: str) -> list[dict]:
+    """Returns the messages for solving a given blocksworld task."""
     prompt = get_blocksworld_task_prompt(int_state_to_char(state), strategy)
-    messages = [{'role': 'user', 'content': [{'text': prompt, 'type': 'text'}]}]
-    generate_response_file(file_path, messages, model_name)
+    return [{'role': 'user', 'content': [{'text': prompt, 'type': 'text'}]}]
+
+def generate_initial_blocksworld_solution(
+        state: tuple[str | int | None, list[list[str | int]]], 
+        strategy: str, 
+        file_path: str, 
+        model_name: str, 
+        *, 
+        use_cache: bool = False
+    ):
+    """Generates a response file for a given blocksworld tasks to the `file_path`"""
+    generate_response_file(file_path, get_initial_blocksworld_messages(state, strategy), model_name, use_cache = use_cache)
+
+# Streaming - the response is read line by line as it comes in. Once the model has written out the plan it commits to as its 
+# final answer, that plan is checked against the problem with the block_code validator, and if it is not executable or reaches 
+# the goal the request is cancelled (the connection closed), so the rest of the response is neither waited for nor generated.
+
+STREAM_STOP_RESULTS = ('NOTEXECUTABLE', 'SUCCESS')
+
+_FINAL_MARKER = re.compile( # `### Final Plan`, `**Final corrected action sequence:**`, `Final sequence of actions`, ...
+    r'\bfinal\s+(?:(?:corrected|correct|complete|executable|revised)\s+)?(?:plan|solution|answer|action\s+sequence|sequence\s+of\s+actions)\b', re.IGNORECASE
+)
+
+class StreamingPlanMonitor:
+    """Follows a response to the (char) `state` as it is streamed in. `feed` it the text as it arrives, it returns the result of the 
+    committed plan (as in `test_plan`) once it is known, otherwise None.
+
+    A plan is committed once it is the run of action lines after a final-answer marker (a line like `### Final Plan`), and the run 
+    is over - its code block is closed, or a line of text follows if it is not in a code block. Its actions are applied as they come in. 
+    Drafts, partial plans and quoted steps are never judged, so a response without a marked final plan is read to the end (and summarised as usual).
+    `result` is `SUCCESS` or `NOTEXECUTABLE` (a committed plan that does not reach the goal is `NOTGOAL`, which does not end the response, 
+    as a later marked plan can follow), and `plan` is the committed plan up to the goal / the action that cannot be applied.
+    """
+    def __init__(self, state: tuple[str | None, list[list[str]]]) -> None:
+        self.initial_state = BlocksState.from_tuple(state, goal_from_state(state))
+        self.result: str | None = None
+        self.plan: list[str] = []
+        self._state = self.initial_state # after `plan`
+        self._outcome: str | None = None # of the committed run so far
+        self._marked = False # a final-answer marker was seen, the next run of actions is the committed plan
+        self._committed = False # inside the committed run
+        self._buffer = '' # the line that is still coming in
+        self._in_code_block = False
+
+    def feed(self, text: str) -> str | None:
+        """Reads the next piece of the response. Returns the result, or None while it is not known yet."""
+        if self.result is not None:
+            return self.result
+        *lines, self._buffer = (self._buffer + text).split('\n')
+        for line in lines:
+            self._read_line(line)
+            if self.result is not None:
+                break
+        return self.result
+
+    def finish(self) -> str | None:
+        """Reads the last line (which has no newline after it) once the response is complete. Returns the result."""
+        if self.result is None and self._buffer:
+            self._read_line(self._buffer)
+        self._buffer = ''
+        if self._committed:
+            self._end_commit()
+        return self.result
+
+    def _end_commit(self) -> None:
+        self._committed = False
+        self.result = self._outcome # None if the plan does not reach the goal
+
+    def _read_line(self, line: str) -> None:
+        if line.strip().startswith('```'):
+            if self._committed:
+                self._end_commit()
+            self._in_code_block = not self._in_code_block
+            return
+
+        action = _parse_action_line(line, allow_note = True)
+        if action is None:
+            if self._committed and not self._in_code_block and line.strip():
+                self._end_commit()
+            elif not self._committed and _FINAL_MARKER.search(line):
+                self._marked = True
+            return
+        if not self._committed:
+            if not self._marked:
+                return
+            self._marked, self._committed = False, True
+            self.plan, self._state, self._outcome = [], self.initial_state.copy(), None
+
+        if self._outcome is None: # like `test_plan`, the actions after the goal or a non-executable action do not count
+            self.plan.append(action)
+            if not apply_action_in_place(action, self._state):
+                self._outcome = 'NOTEXECUTABLE'
+            elif self._state.num_placed == len(self._state.goal_below):
+                self._outcome = 'SUCCESS'
+
+_STREAM_PARAMS = {'stream' : True, 'stream_options' : {'include_usage' : True}}
+
+def _build_streamed_completion(messages: dict, model_name: str, chunks: dict, content: list[str]) -> ChatCompletion:
+    """Puts a streamed response back together as a `ChatCompletion`. If the stream was stopped before the usage came in,
+    the usage is estimated from the text (and the reasoning tokens, which are not known, are 0)."""
+    text = ''.join(content)
+    usage = chunks['usage']
+    if usage is None:
+        prompt_tokens = rate_limiter.estimate_prompt_tokens(messages)
+        completion_tokens = len(text) // rate_limiter.CHARS_PER_TOKEN
+        usage = {
+            'prompt_tokens' : prompt_tokens,
+            'completion_tokens' : completion_tokens,
+            'total_tokens' : prompt_tokens + completion_tokens,
+            'completion_tokens_details' : {'reasoning_tokens' : 0}
+        }
+    return ChatCompletion.model_validate({
+        'id' : chunks['id'] or '',
+        'object' : 'chat.completion',
+        'created' : chunks['created'] or int(time.time()),
+        'model' : chunks['model'] or model_name,
+        'choices' : [{'index' : 0, 'finish_reason' : chunks['finish_reason'] or 'stop', 'message' : {'role' : 'assistant', 'content' : text}}],
+        'usage' : usage
+    })
+
+def _read_chunk(chunk, chunks: dict, content: list[str]) -> str | None:
+    """Records a stream chunk in `chunks` (id, model, usage, ...) and `content`. Returns the text it adds."""
+    chunks.update({'id' : chunk.id, 'created' : chunk.created, 'model' : chunk.model})
+    if chunk.usage is not None:
+        chunks['usage'] = chunk.usage.model_dump()
+    if not chunk.choices:
+        return None
+    choice = chunk.choices[0]
+    chunks['finish_reason'] = choice.finish_reason or chunks['finish_reason']
+    if choice.delta.content:
+        content.append(choice.delta.content)
+    return choice.delta.content
+
+def _get_early_stop(monitor: StreamingPlanMonitor, chunks: dict) -> dict:
+    return {'result' : monitor.result, 'plan' : monitor.plan, 'estimated_usage' : chunks['usage'] is None}
+
+def get_streamed_response(
+        client: OpenAI, 
+        messages: dict, 
+        model_name: str, 
+        state: tuple[str | int | None, list[list[str | int]]], 
+        *, 
+        stop_on: tuple[str, ...] = STREAM_STOP_RESULTS,
+        use_cache: bool = False
+    ) -> tuple[ChatCompletion, dict | None]:
+    """Streams the response to a blocksworld task for `state` through a `StreamingPlanMonitor`, and stops as soon as its result is in `stop_on`.
+
+    Returns `(response, early_stop)`. `early_stop` is None if the response came in complete (or from the cache), otherwise 
+    `{'result', 'plan', 'estimated_usage'}`, and `response` holds the text up to where it was stopped. 
+    With `use_cache`, complete responses are cached like in `get_response`, stopped ones are not.
+    """
+    response, key = _get_cached_response(messages, model_name, use_cache, _STREAM_PARAMS)
+    if response is not None:
+        return response, None
+
+    monitor = StreamingPlanMonitor(int_state_to_char(state))
+    chunks, content = {'id' : None, 'created' : None, 'model' : None, 'finish_reason' : None, 'usage' : None}, []
+    if rate_limiter.RATE_LIMITER is not None:
+        stream = rate_limiter.RATE_LIMITER.create_completion(client, messages, model_name, **_STREAM_PARAMS)
+    else:
+        stream = client.chat.completions.create(model = model_name, messages = messages, **_STREAM_PARAMS)
+
+    stopped = False
+    try:
+        for chunk in stream:
+            text = _read_chunk(chunk, chunks, content)
+            if text and monitor.feed(text) in stop_on:
+                stopped = True
+                break
+    finally:
+        stream.close() # before the end of the stream this drops the connection, which cancels the generation
+
+    response = _build_streamed_completion(messages, model_name, chunks, content)
+    if stopped:
+        return response, _get_early_stop(monitor, chunks)
+    _cache_response(key, response)
+    return response, None
+
+async def get_streamed_response_async(
+        client: AsyncOpenAI, 
+        messages: dict, 
+        model_name: str, 
+        state: tuple[str | int | None, list[list[str | int]]], 
+        *, 
+        stop_on: tuple[str, ...] = STREAM_STOP_RESULTS,
+        use_cache: bool = False
+    ) -> tuple[ChatCompletion, dict | None]:
+    """Async version of `get_streamed_response`."""
+    response, key = _get_cached_response(messages, model_name, use_cache, _STREAM_PARAMS)
+    if response is not None:
+        return response, None
+
+    monitor = StreamingPlanMonitor(int_state_to_char(state))
+    chunks, content = {'id' : None, 'created' : None, 'model' : None, 'finish_reason' : None, 'usage' : None}, []
+    if rate_limiter.RATE_LIMITER is not None:
+        stream = await rate_limiter.RATE_LIMITER.create_completion_async(client, messages, model_name, **_STREAM_PARAMS)
+    else:
+        stream = await client.chat.completions.create(model = model_name, messages = messages, **_STREAM_PARAMS)
+
+    stopped = False
+    try:
+        async for chunk in stream:
+            text = _read_chunk(chunk, chunks, content)
+            if text and monitor.feed(text) in stop_on:
+                stopped = True
+                break
+    finally:
+        await stream.close()
+
+    response = _build_streamed_completion(messages, model_name, chunks, content)
+    if stopped:
+        return response, _get_early_stop(monitor, chunks)
+    _cache_response(key, response)
+    return response, None
+
+def generate_streamed_blocksworld_solution(
+        state: tuple[str | int | None, list[list[str | int]]], 
+        strategy: str, 
+        file_path: str, 
+        model_name: str, 
+        *, 
+        stop_on: tuple[str, ...] = STREAM_STOP_RESULTS,
+        use_cache: bool = False
+    ) -> dict | None:
+    """Streaming version of `generate_initial_blocksworld_solution` (see `get_streamed_response`). Returns the `early_stop` info, 
+    which is also saved in the response file."""
+    messages = get_initial_blocksworld_messages(state, strategy)
+    response, early_stop = get_streamed_response(get_client(), messages, model_name, state, stop_on = stop_on, use_cache = use_cache)
+    save_response_file(file_path, messages, response, early_stop = early_stop)
+    return early_stop
 
 #TODO - just dumped the below ones in
 def error_correct_blocksworld_solution_file(
@@ -158,14 +609,16 @@ def error_correct_blocksworld_solution_file(
         correction_model : str, 
         *, 
         strategy: str = None,
-        repeat_only: bool = False
+        repeat_only: bool = False,
+        resume: bool = False
     ):
     """
     Corrects the incorrect tasks from `solution_file`, into `destination_directory`. 
      - `repeat_only` for removing the error correction message and just running the task again instead.
+     - `resume` to continue in an existing `destination_directory`, skipping the tasks that already have a response file.
     """
 
-    if not make_directory(destination_directory): # setup the directory.
+    if not make_directory(destination_directory, resume = resume): # setup the directory.
         raise FileExistsError(f'ERROR: {destination_directory} already exists.')
 
     with open(solution_file) as in_file:
@@ -182,6 +635,8 @@ def error_correct_blocksworld_solution_file(
 
         if result_type == 'SUCCESS': # skip the ones that dont need correcting
             continue
+        if resume and os.path.exists(f'{destination_directory}/{problem['tag']}_response.json'):
+            continue # done before the restart
 
         print(f'Correcting {problem['tag']} [{index + 1}/{len(result_dicts)}]' + (' (repeat only)' if repeat_only else ''))
 
@@ -223,34 +678,193 @@ def parse_crt_formula(formula_text: str) -> dict | None:
     except:
         return None
 
+# Local formula evaluation - the answers are linear in X and Y, so `AY - BX` can be read off the formula without the summary model.
+
+_CRT_TOKEN = re.compile(r'\s*(?:(\d+(?:\.\d+)?)|([XY])|([-+*/()]))')
+_CRT_REPLACEMENTS = {'\u2212' : '-', '\u2013' : '-', '\u00d7' : '*', '\u22c5' : '*', '\u00b7' : '*', '\\times' : '*', '\\cdot' : '*', '[' : '(', ']' : ')', '{' : '(', '}' : ')'}
+
+class _CrtFormulaParser:
+    """Recursive descent over `+ - * / ( )`, numbers, X and Y (with implicit multiplication, e.g. `6X` or `2(Y - X)`).
+    Every sub-expression is kept as `{'X' : coefficient, 'Y' : coefficient, '1' : constant}`, products of two non-constants are rejected."""
+    def __init__(self, tokens: list[tuple[str, str]]) -> None:
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> tuple[str, str] | None:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> tuple[str, str]:
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def parse_sum(self) -> dict[str, Fraction]:
+        total = self.parse_product()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            sign = 1 if self.take()[1] == '+' else -1
+            term = self.parse_product()
+            total = {key : total[key] + sign * term[key] for key in total}
+        return total
+
+    def parse_product(self) -> dict[str, Fraction]:
+        product = self.parse_unary()
+        while (token := self.peek()) is not None and (token in (('op', '*'), ('op', '/')) or token[0] in ('number', 'variable') or token == ('op', '(')):
+            operator = self.take()[1] if token[0] == 'op' and token[1] in '*/' else '*' # anything else is implicit multiplication
+            factor = self.parse_unary()
+            if operator == '/':
+                if factor['X'] or factor['Y'] or not factor['1']:
+                    raise ValueError('Division by a variable or zero')
+                product = {key : value / factor['1'] for key, value in product.items()}
+            elif not (product['X'] or product['Y']):
+                product = {key : value * product['1'] for key, value in factor.items()}
+            elif not (factor['X'] or factor['Y']):
+                product = {key : value * factor['1'] for key, value in product.items()}
+            else:
+                raise ValueError('Not linear')
+        return product
+
+    def parse_unary(self) -> dict[str, Fraction]:
+        if self.peek() in (('op', '+'), ('op', '-')):
+            sign = 1 if self.take()[1] == '+' else -1
+            return {key : sign * value for key, value in self.parse_unary().items()}
+        return self.parse_atom()
+
+    def parse_atom(self) -> dict[str, Fraction]:
+        kind, value = self.take() # IndexError at the end of the formula
+        if kind == 'number':
+            return {'X' : Fraction(0), 'Y' : Fraction(0), '1' : Fraction(value)}
+        if kind == 'variable':
+            return {'X' : Fraction(value == 'X'), 'Y' : Fraction(value == 'Y'), '1' : Fraction(0)}
+        if value == '(':
+            inner = self.parse_sum()
+            if not self.take() == ('op', ')'):
+                raise ValueError('Unbalanced brackets')
+            return inner
+        raise ValueError(f'Unexpected {value}')
+
+def evaluate_crt_formula(formula_text: str) -> dict | None:
+    """Reads `{'A': int, 'B': int}` (for `AY - BX`) straight from an extracted formula such as `10Y - 6X`, `Y - (3*2)X` or `T = 2(3Y - X)`.
+    Returns None if the formula is not a linear combination of X and Y with integer coefficients (and no constant), 
+    or contains anything else (words, other variables, ...) - those are left to the summary model."""
+    text = formula_text.strip().strip('`$').replace('\\(', '').replace('\\)', '')
+    for old, new in _CRT_REPLACEMENTS.items():
+        text = text.replace(old, new)
+    text = text.split('=')[-1].strip().rstrip('.') # `T = ...` 
+    text = re.sub(r'\s*days?$', '', text, flags = re.IGNORECASE).replace('x', 'X').replace('y', 'Y')
+
+    tokens, position = [], 0
+    while position < len(text.rstrip()):
+        match = _CRT_TOKEN.match(text, position)
+        if match is None:
+            return None
+        number, variable, operator = match.groups()
+        tokens.append(('number', number) if number is not None else ('variable', variable) if variable is not None else ('op', operator))
+        position = match.end()
+    if not tokens:
+        return None
+
+    parser = _CrtFormulaParser(tokens)
+    try:
+        linear = parser.parse_sum()
+    except (ValueError, IndexError, ZeroDivisionError):
+        return None
+    if parser.position < len(tokens) or linear['1'] or not linear['Y'].denominator == linear['X'].denominator == 1:
+        return None
+    return {'A' : int(linear['Y']), 'B' : int(-linear['X'])}
+
 def generate_crt_strategy(target_dir: str, strategy_num: int, model_name: str):
     generate_general_strategy(CRT_STRATEGY_PROMPT, target_dir, strategy_num, model_name)
 
-def generate_crt_solution(question: str, strategy: str | None, answer_model: str) -> str:
+def get_crt_messages(question: str, strategy: str | None) -> list[dict]:
+    return [{'role': 'user', 'content': [{'text': get_crt_task_prompt(question, strategy), 'type': 'text'}]}]
+
+def get_crt_summary_messages(solution_text: str) -> list[dict]:
+    return [
+        {"role": "assistant", "content": [{"text": extract_crt_formula(solution_text), "type": "text"}]},
+        {'role': 'user', 'content': [{'text': CRT_SUMMARY_PROMPT, 'type': 'text'}]}
+    ]
+
+def generate_crt_solution(question: str, strategy: str | None, answer_model: str, *, use_cache: bool = False) -> str:
     """Takes a CRT `question`, `strategy` and `answer_model` (all str).
     
     Returns `solution` string.
     """
-    client = OpenAI(api_key = os.getenv('OPENAI_API_KEY_LAB')) # replace with however you store your key
-    messages = [{'role': 'user', 'content': [{'text': get_crt_task_prompt(question, strategy), 'type': 'text'}]}]
-    response = get_response(client, messages, answer_model)
+    client = get_client() # shared, pooled client (see api_client.py)
+    response = get_response(client, get_crt_messages(question, strategy), answer_model, use_cache = use_cache)
 
     return response.choices[0].message.content
 
 def summarise_crt_solution(solution_text: str, summary_model: str) -> dict | None:
     """Summarises the solution text into a json dict with A and B values for AY - BX"""
-    client = OpenAI(api_key = os.getenv('OPENAI_API_KEY_LAB')) # replace with however you store your key
-    solution_formula = extract_crt_formula(solution_text)
-
-    messages = [
-        {"role": "assistant", "content": [{"text": solution_formula, "type": "text"}]},
-        {'role': 'user', 'content': [{'text': CRT_SUMMARY_PROMPT, 'type': 'text'}]}
-    ]
-    response = get_response(client, messages, summary_model)
+    client = get_client() # shared, pooled client (see api_client.py)
+    response = get_response(client, get_crt_summary_messages(solution_text), summary_model, use_cache = True)
     json_text = response.choices[0].message.content
     return parse_crt_formula(json_text)
 
-
-
-
-
+def get_crt_answer(solution_text: str, summary_model: str, *, local_evaluation: bool = True) -> dict:
+    """Returns `{'proposed_answer', 'formula', 'extraction'}` for a CRT solution. The answer is read from the formula with `evaluate_crt_formula`
+    (`extraction` is `local`), and the summary model is only asked when that fails or `local_evaluation` is False (`extraction` is `summary_model`)."""
+    formula = extract_crt_formula(solution_text)
+    proposed_answer = evaluate_crt_formula(formula) if local_evaluation else None
+    if proposed_answer is not None:
+        return {'proposed_answer' : proposed_answer, 'formula' : formula, 'extraction' : 'local'}
+    return {'proposed_answer' : summarise_crt_solution(solution_text, summary_model), 'formula' : formula, 'extraction' : 'summary_model'}
+
+async def _solve_crt_problems_async(
+        questions: dict[str, str], 
+        strategy: str | None, 
+        answer_model: str, 
+        summary_model: str, 
+        max_concurrency: int, 
+        local_evaluation: bool,
+        use_cache: bool,
+        on_answer: Callable[[str, dict], None] | None
+    ) -> dict[str, dict]:
+    client = new_async_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    answers = {}
+    num_failed = 0
+
+    async def solve(prob_tag: str, question: str):
+        nonlocal num_failed
+        try:
+            async with semaphore:
+                response = await get_response_async(client, get_crt_messages(question, strategy), answer_model, use_cache = use_cache)
+            solution_text = response.choices[0].message.content
+            formula = extract_crt_formula(solution_text)
+            proposed_answer = evaluate_crt_formula(formula) if local_evaluation else None
+            if proposed_answer is not None:
+                answers[prob_tag] = {'proposed_answer' : proposed_answer, 'formula' : formula, 'extraction' : 'local'}
+            else:
+                async with semaphore: # the summary waits for a free slot like any other request
+                    summary = await get_response_async(client, get_crt_summary_messages(solution_text), summary_model, use_cache = True)
+                answers[prob_tag] = {'proposed_answer' : parse_crt_formula(summary.choices[0].message.content), 'formula' : formula, 'extraction' : 'summary_model'}
+        except Exception as error: # not an answer, so it is left out (like a failed response file)
+            print(f'WARNING: Request for CRT {prob_tag} failed ({type(error).__name__}: {error})')
+            num_failed += 1
+            return
+        print(f'Solved CRT {prob_tag} [{len(answers)}/{len(questions) - num_failed}]')
+        if on_answer is not None:
+            on_answer(prob_tag, answers[prob_tag])
+
+    async with client:
+        await asyncio.gather(*(solve(prob_tag, question) for prob_tag, question in questions.items()))
+    return answers
+
+def solve_crt_problems_async(
+        questions: dict[str, str], 
+        strategy: str | None, 
+        answer_model: str, 
+        summary_model: str, 
+        *, 
+        max_concurrency: int = 8, 
+        local_evaluation: bool = True,
+        use_cache: bool = False,
+        on_answer: Callable[[str, dict], None] | None = None
+    ) -> dict[str, dict]:
+    """Solves and summarises every `{prob_tag : question}` with up to `max_concurrency` requests in flight.
+    Returns `{prob_tag : answer}` in the `get_crt_answer` format, with `proposed_answer` None if the answer could not be parsed.
+    Problems whose requests failed are left out (and `on_answer` is not called for them), so they can be asked again.
+    `use_cache` applies to the answer requests (see `get_response`). `on_answer(prob_tag, answer)` is called as each answer comes in."""
+    if max_concurrency < 1:
+        raise ValueError(f'max_concurrency must be at least 1, got {max_concurrency}')
+    return _run_async(_solve_crt_problems_async(questions, strategy, answer_model, summary_model, max_concurrency, local_evaluation, use_cache, on_answer))
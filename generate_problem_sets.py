@@ -2,6 +2,14 @@ import math
 import random
 import os
 import json
+import types
+from collections import deque
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, count
+from typing import Iterator
+
+import numpy as np
 
 # BLOCKSWORLD - algorithm taken from the paper 
 # Slaney, John, and Sylvie Thiébaux. 2001. “Blocks World Revisited.” Artificial Intelligence 125 (1–2): 119–53.
@@ -21,6 +29,94 @@ import json
     
 #     return sum(internal_func(n, k, i) for i in range(0, n + 1))
 
+R_TABLE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.r_table_cache')
+
+_exact_r_table: list[list[Fraction]] = [[]] # row phi holds tau = 0...size - phi, loaded/extended on demand
+_p_table: np.ndarray | None = None
+
+def _extend_exact_r_table(r_table: list[list[Fraction]], size: int) -> None:
+    """Extends the exact R-table in place so that it covers `size` blocks. 
+    Entries do not depend on the table size, so only the new `phi + tau` diagonals are computed."""
+    old_size = len(r_table) - 1
+    r_table += [[] for _ in range(size - old_size)]
+    r_table[1] += [Fraction(1) for _ in range(size - old_size)]
+    for phi in range(2, size + 1):
+        for tau in range(len(r_table[phi]), size - phi + 1):
+            top_line = r_table[phi - 1][tau] * (phi - 1 + tau + r_table[phi - 1][tau + 1])
+            bottom_line = phi - 2 + tau + r_table[phi - 1][tau]
+            r_table[phi].append(top_line / bottom_line)
+
+def _compute_p_table(r_table: list[list[Fraction]]) -> np.ndarray:
+    """Turns the exact R-table into an array of the probabilities of grounding the selected tower."""
+    size = len(r_table) - 1
+    p_table = np.full((size + 1, size + 1), np.nan)
+    for phi in range(1, size + 1):
+        for tau, r_value in enumerate(r_table[phi]):
+            p_table[phi, tau] = float(r_value / (r_value + phi + tau - 1)) # exact until the final (correctly rounded) conversion
+    return p_table
+
+def _save_r_table_cache(r_table: list[list[Fraction]]) -> None:
+    """Stores the exact table (as numerator/denominator pairs) and the probability table (as `.npy`) in `R_TABLE_CACHE_DIR`."""
+    os.makedirs(R_TABLE_CACHE_DIR, exist_ok = True)
+    exact_path = os.path.join(R_TABLE_CACHE_DIR, 'r_table.json')
+    p_table_path = os.path.join(R_TABLE_CACHE_DIR, 'p_table.npy')
+
+    with open(f'{exact_path}.tmp', 'w') as outfile:
+        json.dump([[[r_value.numerator, r_value.denominator] for r_value in row] for row in r_table], outfile)
+    with open(f'{p_table_path}.tmp', 'wb') as outfile:
+        np.save(outfile, _compute_p_table(r_table))
+
+    # swap the files in at the end, so other processes never read a half-written table
+    os.replace(f'{exact_path}.tmp', exact_path)
+    os.replace(f'{p_table_path}.tmp', p_table_path)
+
+def get_exact_r_table(size: int) -> list[list[Fraction]]:
+    """Returns the exact (`Fraction`) R-table covering at least `size` blocks, as `R-Table[phi][tau]` for `phi + tau <= size`.
+
+    The table is loaded from `R_TABLE_CACHE_DIR` the first time it is needed, and only extended (and saved again)
+    when a larger size is requested than has ever been computed before.
+    """
+    global _exact_r_table
+    if len(_exact_r_table) - 1 >= size:
+        return _exact_r_table
+
+    exact_path = os.path.join(R_TABLE_CACHE_DIR, 'r_table.json')
+    if os.path.exists(exact_path):
+        with open(exact_path) as infile:
+            _exact_r_table = [[Fraction(*pair) for pair in row] for row in json.load(infile)]
+
+    if len(_exact_r_table) - 1 < size:
+        _extend_exact_r_table(_exact_r_table, size)
+        try:
+            _save_r_table_cache(_exact_r_table)
+        except OSError as error:
+            print(f'WARNING: Could not save the R-table cache to {R_TABLE_CACHE_DIR} ({error}).')
+
+    return _exact_r_table
+
+def get_table_probabilities(size: int) -> np.ndarray:
+    """Returns the probabilities of grounding the selected tower, covering at least `size` blocks.
+
+    Returns: P-Table[ungrounded (phi)][grounded (tau)], `nan` where the R-table has no entry. 
+    The array is memory-mapped (read-only) from the cache in `R_TABLE_CACHE_DIR`.
+    """
+    global _p_table
+    if _p_table is not None and len(_p_table) > size:
+        return _p_table
+
+    p_table_path = os.path.join(R_TABLE_CACHE_DIR, 'p_table.npy')
+    for _ in range(2): # try the cache as it is first, then again after making sure that it is big enough
+        try:
+            _p_table = np.load(p_table_path, mmap_mode = 'r')
+        except OSError:
+            _p_table = None
+        if _p_table is not None and len(_p_table) > size:
+            return _p_table
+        get_exact_r_table(size)
+
+    _p_table = _compute_p_table(_exact_r_table) # the cache could not be written, so keep the table in memory
+    return _p_table
+
 def generate_r_table(size: int) -> list[list[float]]:
     """ Generates the table of R-relations between the number of
         grounded towers and the number of ungrounded towers used
@@ -29,14 +125,13 @@ def generate_r_table(size: int) -> list[list[float]]:
         Returns: R-Table[ungrounded (phi)][grounded (tau)].
 
         phi 0 and tau size, and all phi + tau > size are not possible.
+        The values are computed exactly (see `get_exact_r_table`) and rounded to floats.
     """
     r_table = [[None for _ in range(size + 1)] for _ in range(size + 1)]
-    r_table[1] = [1 for _ in range(size + 1)]
-    for phi in range(2, size + 1):
+    exact_r_table = get_exact_r_table(size)
+    for phi in range(1, size + 1):
         for tau in range(size - phi + 1):
-            top_line = r_table[phi - 1][tau] * (phi - 1 + tau + r_table[phi - 1][tau + 1])
-            bottom_line = phi - 2 + tau + r_table[phi - 1][tau]
-            r_table[phi][tau] = top_line / bottom_line
+            r_table[phi][tau] = float(exact_r_table[phi][tau])
     return r_table
 
 
@@ -83,42 +178,114 @@ def _generate_blocksworld_states(num_states: int, num_blocks_range: tuple[int, i
     
     return states
 
+def _sample_blocksworld_on_vectors(num_states: int, num_blocks: int, p_table: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Batched version of `_generate_blocksworld_state`, draws `num_states` states with `num_blocks` blocks at once.
+
+    Every state grounds or places exactly one ungrounded tower per step, so the whole batch moves in lockstep
+    (`phi` is shared, only `tau` differs per state). Towers are identified by their bottom block.
+
+    Returns the "on" vectors as an `int` array of shape `(num_states, num_blocks)`,
+    where `on[s, b]` is the block that `b` sits on in state `s`, or `-1` if `b` is on the table.
+    """
+    rows = np.arange(num_states)
+    on = np.full((num_states, num_blocks), -1, dtype = np.int32)
+    top = np.tile(np.arange(num_blocks, dtype = np.int32), (num_states, 1)) # top block of the tower with the given bottom block
+    ungrounded = top.copy() # bottoms of the ungrounded towers, the first `phi` columns are live
+    grounded = np.zeros((num_states, num_blocks), dtype = np.int32) # bottoms of the grounded towers, the first `tau` columns are live
+    tau = np.zeros(num_states, dtype = np.int32)
+
+    for phi in range(num_blocks, 0, -1):
+        index = rng.integers(0, phi, size = num_states) # select an ungrounded tower at random
+        moving = ungrounded[rows, index]
+        to_table = rng.random(num_states) < p_table[phi, tau] # select table according to probability ratio
+
+        # select from all other towers with uniform probability - grounded ones first, then the other ungrounded ones
+        choice = rng.integers(0, np.maximum(phi + tau - 1, 1), size = num_states)
+        other = choice - tau
+        other += other >= index # skip over the selected tower
+        target = np.where(choice < tau, grounded[rows, np.minimum(choice, num_blocks - 1)], ungrounded[rows, np.clip(other, 0, phi - 1)])
+
+        stacked = rows[~to_table]
+        on[stacked, moving[stacked]] = top[stacked, target[stacked]] # put the ungrounded tower on top of the selected one
+        top[stacked, target[stacked]] = top[stacked, moving[stacked]]
+
+        placed = rows[to_table]
+        grounded[placed, tau[placed]] = moving[placed] # place the tower onto the table
+        tau[placed] += 1
+
+        ungrounded[rows, index] = ungrounded[:, phi - 1] # drop the selected tower, the order of the ungrounded towers does not matter
+
+    return on
+
+def generate_blocksworld_state_batches(
+        num_states: int,
+        num_blocks_range: tuple[int, int],
+        *,
+        batch_size: int = 10_000,
+        rng: np.random.Generator | None = None
+    ) -> Iterator[np.ndarray]:
+    """Streams `num_states` random BlocksWorld states as "on" vectors (see `_sample_blocksworld_on_vectors`).
+    Same distribution as `_generate_blocksworld_states`, but no Python lists are built.
+
+    The number of blocks is selected uniformly from `num_blocks_range` (works like `range()`).
+    Every yielded array holds states of a single size, so it has shape `(count, num_blocks)`.
+    """
+    if not num_blocks_range[1] > num_blocks_range[0]:
+        raise ValueError(f'Weird range: ({num_blocks_range[0]}, {num_blocks_range[1]})')
+
+    rng = np.random.default_rng() if rng is None else rng
+    p_table = get_table_probabilities(num_blocks_range[1])
+
+    for start in range(0, num_states, batch_size):
+        sizes = rng.integers(num_blocks_range[0], num_blocks_range[1], size = min(batch_size, num_states - start))
+        for num_blocks, count in zip(*np.unique(sizes, return_counts = True)):
+            yield _sample_blocksworld_on_vectors(int(count), int(num_blocks), p_table, rng)
+
+def on_vectors_to_states(on: np.ndarray) -> list[list[list[int]]]:
+    """Turns an array of "on" vectors back into `list[list[int]]` states (stacks are `bottom -> top`, ordered by bottom block)."""
+    num_states, num_blocks = on.shape
+    above = np.full((num_states, num_blocks + 1), -1, dtype = np.int32) # last column soaks up the table
+    rows, blocks = np.nonzero(on >= 0)
+    above[rows, on[rows, blocks]] = blocks
+
+    states = []
+    for state_above, state_on in zip(above.tolist(), on.tolist()):
+        state = []
+        for bottom in range(num_blocks):
+            if state_on[bottom] == -1:
+                stack = [bottom]
+                while (block := state_above[stack[-1]]) != -1:
+                    stack.append(block)
+                state.append(stack)
+        states.append(state)
+    return states
+
 def get_moves_for_stack(stack: list[int], global_max: int) -> int:
     """Internal function to predict the number of moves that it will take to fully move a stack into its goal postitions."""
-    # search through the stack to find the max. everything above the max will need to be moved twice. 
-    # the max will only ever need to be moved once (this is trivial). below the max, this process is repeated.
-
     if len(stack) == 0:
         return 0
 
-    if stack[0] == global_max: #this stack is a little bit special
+    if stack[0] == global_max: # this stack is a little bit special
         next_index = 1
         next_block = global_max - 1
         while next_index < len(stack) and stack[next_index] == next_block:
             next_index += 1
             next_block -= 1
-        
-        moves = 2 * (len(stack) - next_index)
-        # print(f'Stack {stack} is part of the main tower. Clearing the top blocks takes {moves} moves.')
-        return moves # basically, we have to move all of the out-of-order blocks off the main tower
-        
-    # this is the code for a regular stack 
-
-    if len(stack) == 1: # stacks of one block only ever need to be placed on the main tower.
-        # print(f'Block {stack} only takes one move.')
-        return 1
-
-    max_index = 0
-    max_value = stack[max_index]
-
-    for index, value in enumerate(stack):
-        if value > max_value:
-            max_value = value
-            max_index = index
-    
-    # 2 moves for everything above + 1 move for the max + variable number for the ones below
-    moves = 2 * (len(stack) - max_index - 1) + 1 + get_moves_for_stack(stack[:max_index], global_max)
-    # print(f'Moving {stack} takes {moves} moves, max_index was {max_index}')
+
+        return 2 * (len(stack) - next_index) # basically, we have to move all of the out-of-order blocks off the main tower
+
+    # this is the code for a regular stack. everything above the max will need to be moved twice, 
+    # the max will only ever need to be moved once (this is trivial). below the max, this process is repeated.
+    # so every block that is bigger than all of the blocks below it is moved once, and the rest are moved twice.
+    moves = 0
+    max_below = -1
+    for block in stack:
+        if block > max_below:
+            max_below = block
+            moves += 1
+        else:
+            moves += 2
+
     return moves
 
 
@@ -126,26 +293,202 @@ def get_solution_length(state: list[list[int]]) -> int:
     """Returns the number of steps required to solve a BlocksWorld task starting at `state` and finishing at `max_block, ..., 0`"""
     # asssumes the end goal is to stack the blocks with 0 at the top.
     # state is [[stack1] [stack2] ... ] where [stack is bottom -> top]
-    global_max = len(sum(state, [])) - 1
+    global_max = sum(len(stack) for stack in state) - 1
     return sum(2 * get_moves_for_stack(stack, global_max) for stack in state)
 
-def generate_unique_problem_set(num_problems: int, block_range: tuple[int, int], cost_range: tuple[int, int]) -> list[tuple[int, list[list[int]]]]:
+def get_solution_lengths(on: np.ndarray) -> np.ndarray:
+    """Batch version of `get_solution_length` for an array of "on" vectors (see `_sample_blocksworld_on_vectors`).
+
+    Works on whole towers at once by pointer jumping (log2(num_blocks) rounds), 
+    so every state is scored without building any Python lists.
+    """
+    num_states, num_blocks = on.shape
+    blocks = np.arange(num_blocks)
+    offsets = (np.arange(num_states) * num_blocks)[:, None] # flat indexing is a lot faster than `take_along_axis`
+    on_table = on < 0
+
+    jump = np.where(on_table, blocks, on) + offsets # points further down the tower each round, bottom blocks point to themselves
+    max_below = np.where(on_table, -1, on) # max over the blocks strictly below, up to and including `jump`
+    good = np.where(on_table, blocks == num_blocks - 1, on == blocks + 1) # sits where it does in the goal tower
+    all_good = np.where(on_table, True, good) # good all the way from the block down to (not including) `jump`
+
+    for _ in range(max(num_blocks - 1, 1).bit_length()):
+        max_below = np.maximum(max_below, max_below.ravel()[jump])
+        all_good &= all_good.ravel()[jump]
+        jump = jump.ravel()[jump]
+
+    # `jump` now holds the bottom block of every tower
+    in_main_tower = jump - offsets == num_blocks - 1
+    in_place = all_good & good.ravel()[jump]
+
+    moves = np.where(in_main_tower, np.where(in_place, 0, 2), np.where(blocks > max_below, 1, 2))
+    return 2 * moves.sum(axis = 1)
+
+def canonical_state(state: list[list[int]]) -> tuple[tuple[int, ...], ...]:
+    """Hashable form of a state that ignores the order of the stacks."""
+    return tuple(sorted(tuple(stack) for stack in state))
+
+def get_cost_quotas(num_problems: int, cost_range: tuple[int, int], cost_distribution: str | dict[int, float] | None) -> dict[int, int] | None:
+    """Splits `num_problems` into per-cost quotas for the costs in `cost_range` (only even costs are possible).
+
+        - `None` does not constrain the costs at all (returns `None`).
+        - `'uniform'` gives every possible cost the same share.
+        - `{cost : weight}` gives each cost a share proportional to its weight.
+
+    Leftover problems from rounding go to the costs with the largest remainders (lowest costs first on ties).
+    """
+    if cost_distribution is None:
+        return None
+
+    if cost_distribution == 'uniform':
+        cost_distribution = {cost : 1 for cost in range(cost_range[0] + cost_range[0] % 2, cost_range[1], 2)}
+    elif isinstance(cost_distribution, str):
+        raise ValueError(f'Unknown cost distribution: {cost_distribution}')
+
+    weights = {cost : weight for cost, weight in sorted(cost_distribution.items()) if weight > 0}
+    if not weights or not all(cost_range[0] <= cost < cost_range[1] and cost % 2 == 0 for cost in weights):
+        raise ValueError(f'Costs {list(weights)} do not fit the cost range ({cost_range[0]}, {cost_range[1]})')
+
+    total = sum(weights.values())
+    shares = {cost : num_problems * weight / total for cost, weight in weights.items()}
+    quotas = {cost : math.floor(share) for cost, share in shares.items()}
+    leftover = num_problems - sum(quotas.values())
+    for cost in sorted(shares, key = lambda cost: quotas[cost] - shares[cost])[:leftover]:
+        quotas[cost] += 1
+
+    return quotas
+
+class ProblemSetBuilder:
+    """Collects unique problems until every cost bucket is full.
+
+    Uniqueness is checked against a hashed index of `canonical_state` forms, so offering a state is O(1).
+    With `quotas` set to `None` there is a single bucket that takes any cost.
+    """
+    def __init__(self, num_problems: int, cost_range: tuple[int, int], quotas: dict[int, int] | None = None) -> None:
+        self.cost_range = cost_range
+        self.remaining = {None : num_problems} if quotas is None else dict(quotas)
+        self.num_missing = sum(self.remaining.values())
+        self.index = set()
+        self.problems = []
+
+    def offer(self, cost: int, state: list[list[int]]) -> bool:
+        """Adds `(cost, state)` if it fits an open cost bucket and has not been seen before. Returns whether it was added."""
+        if not self.cost_range[0] <= cost < self.cost_range[1]:
+            return False
+
+        bucket = None if None in self.remaining else cost
+        if not self.remaining.get(bucket):
+            return False
+
+        key = canonical_state(state)
+        if key in self.index:
+            return False
+
+        self.index.add(key)
+        self.problems.append((cost, [list(stack) for stack in key])) # sorted to deal with shuffled stacks
+        self.remaining[bucket] -= 1
+        self.num_missing -= 1
+        return True
+
+    def is_full(self) -> bool:
+        return self.num_missing == 0
+
+def _generate_problem_chunk(
+        entropy: int, 
+        chunk_index: int, 
+        chunk_size: int, 
+        block_range: tuple[int, int], 
+        cost_range: tuple[int, int]
+    ) -> list[tuple[int, list[list[int]]]]:
+    """Samples one chunk of `chunk_size` states and returns the `(cost, state)` candidates that fall inside `cost_range`.
+
+    Every chunk has its own seed derived from `entropy`, so a chunk always gives the same result, whichever process runs it.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key = (chunk_index,)))
+    candidates = []
+    for on in generate_blocksworld_state_batches(chunk_size, block_range, batch_size = chunk_size, rng = rng):
+        costs = get_solution_lengths(on)
+        in_range = (cost_range[0] <= costs) & (costs < cost_range[1]) # filter out the ones outside of our net
+        candidates += zip(costs[in_range].tolist(), on_vectors_to_states(on[in_range]))
+    return candidates
+
+def _iterate_problem_chunks(
+        entropy: int,
+        chunk_size: int, 
+        block_range: tuple[int, int], 
+        cost_range: tuple[int, int], 
+        num_workers: int
+    ) -> Iterator[list[tuple[int, list[list[int]]]]]:
+    """Yields the results of `_generate_problem_chunk` for chunks 0, 1, 2... in order. 
+    With `num_workers > 1` the chunks are generated ahead of time in a process pool."""
+    if num_workers == 1:
+        yield from (_generate_problem_chunk(entropy, chunk_index, chunk_size, block_range, cost_range) for chunk_index in count())
+        return
+
+    with ProcessPoolExecutor(num_workers) as pool:
+        pending = deque()
+        try:
+            for chunk_index in count():
+                pending.append(pool.submit(_generate_problem_chunk, entropy, chunk_index, chunk_size, block_range, cost_range))
+                if len(pending) >= 2 * num_workers: # keep every worker busy while the results are merged
+                    yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def generate_unique_problem_set(
+        num_problems: int,
+        block_range: tuple[int, int],
+        cost_range: tuple[int, int],
+        *,
+        cost_distribution: str | dict[int, float] | None = None,
+        max_samples: int | None = 10_000_000,
+        seed: int | None = None,
+        num_workers: int = 1,
+        chunk_size: int = 10_000
+    ) -> list[tuple[int, list[list[int]]]]:
     """
         Generates `num_problems` states with `block_range` blocks and solutions bounded by `cost_range`. 
         All ranges work as normal, but `cost_range` should be used in multiples of two.
 
+        `cost_distribution` sets how the costs are spread over the problem set (see `get_cost_quotas`).
+        By default the costs are not controlled, so they follow the sampling distribution within `cost_range`.
+
+        Sampling stops as soon as every cost bucket is full. Costs that `block_range` cannot reach 
+        (every even cost up to `4 * (num_blocks - 1)` is possible) raise a ValueError up front, and if the buckets are still not full 
+        after `max_samples` states (e.g. there are not enough unique states of some cost) a RuntimeError is raised. 
+        `max_samples = None` samples until the buckets are full.
+
+        The states are sampled in chunks of `chunk_size`, each with a seed derived from `seed`, across `num_workers` processes. 
+        The chunks are merged in order, so the output only depends on `seed` (and `chunk_size`), not on `num_workers`.
+
         Returns list of tuples `[cost, state]`.
     """
-    state_list = []
-    while len(state_list) < num_problems:
-        for generated_state in _generate_blocksworld_states(num_problems, block_range):
-            solution_length = get_solution_length(generated_state)
-            if cost_range[0] <= solution_length < cost_range[1]: # filter out the ones outside of our net
-                generated_state = sorted(generated_state) # to deal with shuffled stacks
-                if not generated_state in state_list:
-                    state_list.append((solution_length, generated_state))
+    quotas = get_cost_quotas(num_problems, cost_range, cost_distribution)
+    max_cost = 4 * (block_range[1] - 2) # with the most blocks
+    unreachable = [cost for cost in ([cost_range[0]] if quotas is None else [cost for cost, quota in quotas.items() if quota > 0]) if cost > max_cost]
+    if unreachable:
+        raise ValueError(f'Costs {unreachable} are not possible with at most {block_range[1] - 1} blocks (max cost {max_cost})')
+
+    builder = ProblemSetBuilder(num_problems, cost_range, quotas)
+    get_table_probabilities(block_range[1]) # make sure the R-table cache exists before any workers start
+    entropy = np.random.SeedSequence(seed).entropy
+    num_samples = 0
+
+    for candidates in _iterate_problem_chunks(entropy, chunk_size, block_range, cost_range, num_workers):
+        if builder.is_full():
+            break
+
+        if max_samples is not None and num_samples >= max_samples:
+            raise RuntimeError(f'Stopped after {num_samples} samples with {builder.num_missing} problems missing (buckets left: {builder.remaining})')
 
-    return state_list[:num_problems] # this does not into account biases in selection caused by the cost_range filtering, i.e. costs are not at all uniform within the final output.
+        num_samples += chunk_size
+        for cost, generated_state in candidates:
+            builder.offer(cost, generated_state)
+            if builder.is_full():
+                break
+
+    return builder.problems
 
 def create_blocksworld_problem_json(problem_set: list[tuple[int, list[list[int]]]], problem_set_file_path: str):
     """Problem set is list[(cost, state)...]. Creates `set_file_name` json file."""
@@ -173,25 +516,26 @@ def create_blocksworld_problem_json(problem_set: list[tuple[int, list[list[int]]
 # Nature Computational Science 3 (10): 833–38.
 # https://static-content.springer.com/esm/art%3A10.1038%2Fs43588-023-00527-x/MediaObjects/43588_2023_527_MOESM1_ESM.pdf
 
-def generate_crt_problem(template: str) -> tuple[str, dict]:
+def generate_crt_problem(template: str, rng: random.Random | types.ModuleType = random) -> tuple[str, dict]:
     """ Takes a CRT template as `str` and returns a `tuple[str, dict]` with an instantiated question and an answer of form:
 
         { 'A' : `int`, 'Y' : `int` }
     
         The ranges used for the instantiation variables are hardcoded into the function. 
+        `rng` is the source of randomness, a `random.Random` or the `random` module itself (the default, so `random.seed` still applies).
     """
     # increase by a factor of (2-5) every (2-6)X days from (6-10)Y to 1/(X-val)^(1-3)
-    grow_rate = random.randrange(2,6)
-    rate_period = random.randrange(2,7)
-    completion_time = random.randrange(6,11)
-    steps_back = random.randrange(1, 4)
+    grow_rate = rng.randrange(2,6)
+    rate_period = rng.randrange(2,7)
+    completion_time = rng.randrange(6,11)
+    steps_back = rng.randrange(1, 4)
 
     target: str = f'1/{grow_rate**steps_back}'
 
     # code for full_num, part_num - this is done because the templates have two
     # different ways of setting up the question. Some use fractions and some use
     # a specific full and partial value.
-    part_num = random.randrange(5, 15)
+    part_num = rng.randrange(5, 15)
     full_num = part_num * (grow_rate**steps_back)
 
     answer = {'A' : completion_time, 'B': steps_back * rate_period}
@@ -209,19 +553,32 @@ def generate_crt_problem(template: str) -> tuple[str, dict]:
         problem_text = template.format(grow_rate = rate_lingo[grow_rate], rate_period = f'{rate_period}X', completion_time = f'{completion_time}Y', part_num = str(part_num), full_num = str(full_num))
     return (problem_text + ' X and Y are both numbers, you can use them to represent the final answer. Please think step by step.', answer)
 
-def generate_crt_problems(num_repeats: int, templates_file_path: str, output_file_path: str) -> None:
+def _generate_crt_shard(entropy: int, shard_index: int, template: str, num_repeats: int) -> list[tuple[str, dict]]:
+    """Instantiates `num_repeats` problems for a single template, seeded from `entropy` and the template's `shard_index`."""
+    rng = random.Random(int(np.random.SeedSequence(entropy, spawn_key = (shard_index,)).generate_state(1)[0]))
+    return [generate_crt_problem(template, rng) for _ in range(num_repeats)]
+
+def generate_crt_problems(num_repeats: int, templates_file_path: str, output_file_path: str, *, seed: int | None = None, num_workers: int = 1) -> None:
     """ Instantiates `num_repeats` problems for every template in the json file at `templates_file_path`. 
         Stores the questions and answers as a dictionary in json form at `output_file_path`. 
+
+        Every template is a shard with its own seed derived from `seed`, and the shards can be split across `num_workers` processes.
+        The output only depends on `seed`, not on `num_workers`.
     """
     with open(templates_file_path) as infile:
         prob_dict = json.load(infile)
 
-    problems = []
-    for template in prob_dict.values():
-        for _ in range(num_repeats):
-            problems.append(generate_crt_problem(template))
+    entropy = np.random.SeedSequence(seed).entropy
+    shard_args = [(entropy, shard_index, template, num_repeats) for shard_index, template in enumerate(prob_dict.values())]
+
+    if num_workers == 1:
+        shards = [_generate_crt_shard(*args) for args in shard_args]
+    else:
+        with ProcessPoolExecutor(num_workers) as pool:
+            shards = list(pool.map(_generate_crt_shard, *zip(*shard_args)))
 
-    random.shuffle(problems)
+    problems = list(chain.from_iterable(shards))
+    random.Random(entropy).shuffle(problems)
     
     out_dict = {
         f'crt_prob_{i:04}' : {
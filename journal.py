@@ -0,0 +1,92 @@
+import os
+import json
+import time
+
+# Append-only record of the items a stage has finished, so a stage does not rewrite its whole JSON file after every item,
+# and a crashed run can pick up where it stopped. Every item is one `{"tag" : ..., "record" : ...}` line. Lines are flushed
+# as they are written (safe if the process dies) and fsynced in batches (safe if the machine dies, up to the last batch).
+# At the end of the stage the records are compacted into the usual JSON file and the journal is removed.
+
+def get_journal_path(json_path: str) -> str:
+    """`dir/solution_summary.json` -> `dir/solution_summary_journal.jsonl`"""
+    return f'{os.path.splitext(json_path)[0]}_journal.jsonl'
+
+class Journal:
+    """The journal of `json_path` (see `get_journal_path`). `records` holds everything written so far, including earlier runs."""
+    def __init__(self, json_path: str, *, fsync_every: int = 32, fsync_seconds: float = 2.0) -> None:
+        self.json_path = json_path
+        self.path = get_journal_path(json_path)
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.records: dict[str, object] = self._load()
+        self._file = open(self.path, 'a')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self) -> dict[str, object]:
+        """Reads the records of an earlier run. A last line cut off by a crash is dropped (and truncated, so appends start on a new line)."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+
+        with open(self.path, 'rb') as infile:
+            data = infile.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) < len(data):
+            print(f'WARNING: Dropping an incomplete last record from {self.path}')
+            with open(self.path, 'r+b') as outfile:
+                outfile.truncate(len(complete))
+
+        for line in complete.decode().splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                records[entry['tag']] = entry['record']
+        return records
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, tag: str, record) -> None:
+        """Adds (or replaces) the record for `tag`."""
+        self._file.write(json.dumps({'tag' : tag, 'record' : record}) + '\n')
+        self._file.flush()
+        self.records[tag] = record
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync > self.fsync_seconds:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._unsynced > 0:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def compact(self, order: list[str] = None, *, indent: int = None) -> dict:
+        """Writes the records into `json_path` as one `{tag : record}` dict (in `order` first, if given), then removes the journal.
+        Returns the dict."""
+        self.close()
+        order = [tag for tag in (order or []) if tag in self.records]
+        ordered = set(order)
+        compacted = {tag : self.records[tag] for tag in order + [tag for tag in self.records if tag not in ordered]}
+
+        with open(f'{self.json_path}.tmp', 'w') as outfile:
+            json.dump(compacted, outfile, indent = indent)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(f'{self.json_path}.tmp', self.json_path) # the journal is only removed once the full file is in place
+        os.remove(self.path)
+        return compacted
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
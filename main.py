@@ -4,6 +4,10 @@ import json
 import os
 
 import experiment_code as ec 
+import batch_api
+from journal import Journal
+from batch_validation import test_plans
+from block_code import int_state_to_char, test_plan, PlanPrefixCache
 
 def generate_initial_blocksworld_solutions(
         problem_set: str,
@@ -11,100 +15,308 @@ def generate_initial_blocksworld_solutions(
         main_solution_directory: str,
         *,
         strategy: str = None,
-        summarise_solutions: bool = True
+        summarise_solutions: bool = True,
+        max_concurrency: int = None,
+        resume: bool = False,
+        stream: bool = False,
+        use_cache: bool = False
 ):
     """Generates response files for `problem_set` into `{target_dir}/round_0` using the `model_name` model. 
     By default will summarise solutions into a json file, then evaluate them and save the solution results.
 
     Will use no strategy if strategy is None (default), or `strategy` if it is given.
+
+    `max_concurrency` switches to async mode, with up to that many requests in flight (one at a time if None).
+
+    With `stream`, responses are streamed and checked as they come in, and a request is stopped as soon as the final plan the model 
+    commits to is known not to be executable or to reach the goal (see `ec.StreamingPlanMonitor`). The response files of stopped 
+    requests hold the text up to that point, all other responses are read to the end.
+
+    `use_cache` takes responses to requests that were already made from the response cache (see `ec.get_response`).
+
+    With `resume`, running this again on an existing `main_solution_directory` (e.g. after a crash) skips the problems that 
+    already have a response file, otherwise it aborts if the directory exists. Only resume with the same `problem_set`, `model_name` 
+    and `strategy` as the run that made the directory, since the existing response files are kept as they are.
     
     If you wish to use a different model from `gpt-4o-2024-11-20` to summarise, you will have to set `summarise_solutions` to False, 
     and do it manually using `generate_solution_summaries`. 
     """
 
-    if not ec.make_directory(main_solution_directory): # setup the directory.
+    if not ec.make_directory(main_solution_directory, resume = resume): # setup the directory.
         return
     
     initial_round_dir = f'{main_solution_directory}/round_0'
 
-    os.mkdir(initial_round_dir) # makes the initial dir
+    os.makedirs(initial_round_dir, exist_ok = resume) # makes the initial dir
 
     # load problems from problem_set (tag, opt_cost, state, num_blocks)
     with open(problem_set) as in_file:
         problems: list[dict] = json.load(in_file)
     
-    for index, problem in enumerate(problems):
-        print(f'Generating response file {index + 1}/{len(problems)} to {problem["tag"]}')
-        state = (None, problem['state'])
-        file_path = f'{initial_round_dir}/{problem['tag']}_response.json'
-        ec.generate_initial_blocksworld_solution(state, strategy, file_path, model_name)
+    num_problems = len(problems)
+    problems = [problem for problem in problems if not os.path.exists(f'{initial_round_dir}/{problem['tag']}_response.json')] # done before a restart
+    if len(problems) < num_problems:
+        print(f'Skipping {num_problems - len(problems)} problems that already have response files.')
+
+    if max_concurrency is None:
+        for index, problem in enumerate(problems):
+            print(f'Generating response file {index + 1}/{len(problems)} to {problem["tag"]}')
+            state = (None, problem['state'])
+            file_path = f'{initial_round_dir}/{problem['tag']}_response.json'
+            if stream:
+                early_stop = ec.generate_streamed_blocksworld_solution(state, strategy, file_path, model_name, use_cache = use_cache)
+                if early_stop is not None:
+                    print(f'Stopped early: {early_stop['result']} after {len(early_stop['plan'])} actions')
+            else:
+                ec.generate_initial_blocksworld_solution(state, strategy, file_path, model_name, use_cache = use_cache)
+    else:
+        jobs = [(f'{initial_round_dir}/{problem['tag']}_response.json', ec.get_initial_blocksworld_messages((None, problem['state']), strategy)) for problem in problems]
+        if stream:
+            jobs = [job + ((None, problem['state']),) for job, problem in zip(jobs, problems)]
+        failed = ec.generate_response_files_async(jobs, model_name, max_concurrency = max_concurrency, stream = stream, use_cache = use_cache)
+        if failed:
+            print(f'WARNING: {len(failed)} requests failed, these problems have no response files.')
     
     if summarise_solutions:
-        generate_blocksworld_solutions_summary(problem_set, f'{initial_round_dir}/round_0')
+        generate_blocksworld_solutions_summary(problem_set, initial_round_dir)
         evaluate_solution_file(problem_set, initial_round_dir)
 
 
-def generate_blocksworld_solutions_summary(problem_set: str, responses_directory: str, *, summary_model: str = 'gpt-4o-2024-11-20') -> None:
+def generate_blocksworld_solutions_summary(
+        problem_set: str, 
+        responses_directory: str, 
+        *, 
+        summary_model: str = 'gpt-4o-2024-11-20', 
+        local_extraction: bool = True
+    ) -> None:
     """Summarises the solutions from `response_dir` against the `problem_set` file, into one json file.
     
-    File format: `{prob_tag : action_list}`. `action_list` is `list[str]` 
+    File format: `{prob_tag : {'model_used', 'solution', 'extraction'}}`. `solution` is `list[str]`, `extraction` is `local`, `stream` or `summary_model`.
+
+    Summary model is optional argument to set the GPT model. It is only called for the responses where the plan cannot be 
+    extracted locally (see `ec.extract_pddl_plan`), or for all of them if `local_extraction` is False.
 
-    Summary model is optional argument to set the GPT model. 
+    Summaries are appended to `solution_summary_journal.jsonl` as they are made, and compacted into `solution_summary.json` at the end. 
+    If a journal is left over from a run that stopped early, the problems in it are not summarised again.
     """
 
     # load problems from dir (tag, opt_cost, state, num_blocks)
     with open(problem_set) as in_file:
         problems: list[dict] = json.load(in_file)
     
-    solutions = {}
     solutions_file_path  = f'{responses_directory}/solution_summary.json'
 
-    for index, problem in enumerate(problems):
-        problem_tag = problem['tag']
-        print(f'Summarising solution {index + 1}/{len(problems)} for {problem_tag}', end = ' ')
+    with Journal(solutions_file_path) as solutions:
+        if len(solutions) > 0:
+            print(f'Resuming from {solutions.path} ({len(solutions)} solutions already summarised).')
+
+        for index, problem in enumerate(problems):
+            problem_tag = problem['tag']
+            if problem_tag in solutions:
+                continue
+            print(f'Summarising solution {index + 1}/{len(problems)} for {problem_tag}', end = ' ')
+
+            response_file_path = f'{responses_directory}/{problem_tag}_response.json'
+            try:
+                summary = ec.generate_blocksworld_solution_summary(response_file_path, summary_model, local_extraction = local_extraction)
+            except FileNotFoundError:
+                print(f'Skipping {response_file_path} (does not exist).')
+                continue # skip over the ones that ddon't have responses 
+
+            solutions.append(problem_tag, summary)
+            print(f'({summary['extraction']}, saved to {solutions.path})')
+        
+        # written even when it is empty (all previous solutions were correct), which avoids any missing file shenanigans
+        solutions.compact([problem['tag'] for problem in problems])
+    print(f'Saved {solutions_file_path}')
+
+# Batch mode - a stage is submitted as one batch (see batch_api.py), then collected once the batch is done (which can take up to 24h).
+# Solve: `submit_initial_blocksworld_batch` -> `collect_initial_blocksworld_batch` writes the `_response.json` files.
+# Summarise: `submit_blocksworld_summary_batch` -> `collect_blocksworld_summary_batch` writes `solution_summary.json`.
+
+def submit_initial_blocksworld_batch(
+        problem_set: str,
+        model_name: str,
+        main_solution_directory: str,
+        *,
+        strategy: str = None
+    ) -> str | None:
+    """Batch version of `generate_initial_blocksworld_solutions` - submits every problem in `problem_set` as one batch for `{main_solution_directory}/round_0`.
+    Returns the batch id (also saved in `round_0/solve_batch.json`)."""
+    if not ec.make_directory(main_solution_directory): # setup the directory.
+        return None
+    
+    initial_round_dir = f'{main_solution_directory}/round_0'
+    os.mkdir(initial_round_dir)
+
+    with open(problem_set) as in_file:
+        problems: list[dict] = json.load(in_file)
+
+    requests = {problem['tag'] : ec.get_initial_blocksworld_messages((None, problem['state']), strategy) for problem in problems}
+    return batch_api.submit_batch(initial_round_dir, 'solve', requests, model_name)
 
-        if problem_tag in solutions:
-            print(f'WARNING: Overwriting entry {problem_tag} to solutions file in {responses_directory}')
+def submit_blocksworld_summary_batch(
+        problem_set: str, 
+        responses_directory: str, 
+        *, 
+        summary_model: str = 'gpt-4o-2024-11-20', 
+        local_extraction: bool = True
+    ) -> str | None:
+    """Batch version of `generate_blocksworld_solutions_summary` - submits the summary of every response file in `responses_directory` 
+    that cannot be extracted locally (all of them if `local_extraction` is False) as one batch.
+    Returns the batch id (also saved in `summarise_batch.json`), or None if there was nothing to submit."""
+    with open(problem_set) as in_file:
+        problems: list[dict] = json.load(in_file)
 
-        response_file_path = f'{responses_directory}/{problem_tag}_response.json'
+    requests = {}
+    for problem in problems:
+        response_file_path = f'{responses_directory}/{problem['tag']}_response.json'
         try:
-            solutions[problem_tag] = ec.generate_blocksworld_solution_summary(response_file_path, summary_model)
+            with open(response_file_path) as in_file:
+                response_text = json.load(in_file)['response']['content']
         except FileNotFoundError:
             print(f'Skipping {response_file_path} (does not exist).')
-            continue # skip over the ones that ddon't have responses 
+            continue
+        if local_extraction and ec.extract_pddl_plan(response_text) is not None:
+            continue # done locally when the batch is collected
+        requests[problem['tag']] = ec.get_blocksworld_summary_messages(response_text)
+    
+    if not requests:
+        print(f'Every plan in {responses_directory} can be extracted locally, no batch submitted.')
+        return None
+    return batch_api.submit_batch(responses_directory, 'summarise', requests, summary_model)
+
+def _get_finished_batch_results(directory: str, stage: str, wait: bool, poll_seconds: float) -> dict | None:
+    """Returns the results of the `stage` batch in `directory` (see `batch_api.read_batch_results`), or None if it is not done."""
+    if wait:
+        status = batch_api.wait_for_batch(directory, stage, poll_seconds = poll_seconds)
+    else:
+        status = batch_api.get_batch_status(directory, stage)
+
+    if status not in batch_api.BATCH_FINAL_STATUSES:
+        print(f'Batch for {directory} ({stage}) is still {status}.')
+        return None
+    if not status == 'completed':
+        print(f'WARNING: Batch for {directory} ({stage}) ended as {status}, collecting whatever results it has.')
+    
+    batch_api.download_batch_results(directory, stage)
+    return batch_api.read_batch_results(directory, stage)
 
-        with open(solutions_file_path, 'w') as wfile:
-            json.dump(solutions, wfile)
-        
-        print(f'(saved to {solutions_file_path})')
+def collect_initial_blocksworld_batch(
+        problem_set: str,
+        main_solution_directory: str,
+        *,
+        summarise_solutions: bool = True,
+        wait: bool = True,
+        poll_seconds: float = 60
+    ) -> bool:
+    """Writes the `_response.json` files from the batch submitted by `submit_initial_blocksworld_batch`.
+    Waits for the batch to finish unless `wait` is False, in which case it returns False if the batch is not done yet.
+
+    Like `generate_initial_blocksworld_solutions`, by default summarises (synchronously) and evaluates the solutions afterwards.
+    For a large sweep, set `summarise_solutions` to False and use `submit_blocksworld_summary_batch` instead.
+    """
+    initial_round_dir = f'{main_solution_directory}/round_0'
+    results = _get_finished_batch_results(initial_round_dir, 'solve', wait, poll_seconds)
+    if results is None:
+        return False
     
-    # realistically this is only ever useful when the dict is entirely empty (all previous solutions were correct),
-    # but it is a simple fix to any missing file shenanigans
+    for prob_tag, (messages, response) in results.items():
+        ec.save_response_file(f'{initial_round_dir}/{prob_tag}_response.json', messages, response)
+    print(f'Saved {len(results)} response files to {initial_round_dir}')
+
+    if summarise_solutions:
+        generate_blocksworld_solutions_summary(problem_set, initial_round_dir)
+        evaluate_solution_file(problem_set, initial_round_dir)
+    return True
+
+def collect_blocksworld_summary_batch(
+        problem_set: str,
+        responses_directory: str,
+        *,
+        local_extraction: bool = True,
+        evaluate_solutions: bool = True,
+        wait: bool = True,
+        poll_seconds: float = 60
+    ) -> bool:
+    """Writes `solution_summary.json` (same format as `generate_blocksworld_solutions_summary`) from the locally extracted plans 
+    and the batch submitted by `submit_blocksworld_summary_batch` (`local_extraction` has to match), then evaluates it if `evaluate_solutions`. 
+    Waits for the batch to finish unless `wait` is False, in which case it returns False if the batch is not done yet."""
+    results = {}
+    if os.path.exists(batch_api.get_batch_paths(responses_directory, 'summarise')['tracking']): # there is no batch if every plan was extracted locally
+        results = _get_finished_batch_results(responses_directory, 'summarise', wait, poll_seconds)
+        if results is None:
+            return False
+
+    with open(problem_set) as in_file:
+        problems: list[dict] = json.load(in_file)
+
+    solutions = {}
+    for problem in problems: # kept in problem set order
+        try:
+            with open(f'{responses_directory}/{problem['tag']}_response.json') as in_file:
+                response_data = json.load(in_file)['response']
+        except FileNotFoundError:
+            continue
+
+        solution = ec.extract_pddl_plan(response_data['content']) if local_extraction else None
+        if solution is not None:
+            solutions[problem['tag']] = {'model_used' : response_data['model'], 'solution' : solution, 'extraction' : 'local'}
+        elif problem['tag'] in results:
+            _, summary = results[problem['tag']]
+            solutions[problem['tag']] = {
+                'model_used' : response_data['model'],
+                'solution' : ec.parse_pddl_text(summary.choices[0].message.content),
+                'extraction' : 'summary_model'
+            }
+
+    solutions_file_path = f'{responses_directory}/solution_summary.json'
     with open(solutions_file_path, 'w') as wfile:
         json.dump(solutions, wfile)
+    print(f'Saved {len(solutions)} solutions to {solutions_file_path}')
 
-def evaluate_solution_file(problem_set: str, response_dir: str): #TODO - fix this up
-    """Evaluates the solutions from the `{response_dir}/solution_summary.json` file against the `problem_set` file. 
-    
-    Stores result data in `{response_dir}/solution_results.json` 
-    """
+    if evaluate_solutions:
+        evaluate_solution_file(problem_set, responses_directory)
+    return True
+
+def _load_solution_file(problem_set: str, response_dir: str) -> tuple[list[dict], dict, list[list[str]], list[tuple]]:
+    """Returns `(problems, solutions_dict, solutions, states)` for the problems in `{response_dir}/solution_summary.json`, in problem set order."""
     # load problems from dir (tag, opt_cost, state, num_blocks)
     with open(problem_set) as in_file:
         problems: list[dict] = json.load(in_file)
     
-    solution_file_path = f'{response_dir}/solution_summary.json'
-    with open(solution_file_path) as in_file:
+    with open(f'{response_dir}/solution_summary.json') as in_file:
         solutions_dict: dict = json.load(in_file)
-    results = []
+    problems = [problem for problem in problems if problem['tag'] in solutions_dict] # skip over the ones not in the solution file
+    solutions = [solutions_dict[problem['tag']]['solution'] for problem in problems]
+    states = [int_state_to_char((None, problem['state'])) for problem in problems]
+    return problems, solutions_dict, solutions, states
+
+def warm_plan_cache(problem_set: str, response_dir: str, cache: PlanPrefixCache) -> None:
+    """Validates the plans in `{response_dir}/solution_summary.json` through `cache` (without writing any results), 
+    so that the plans corrected from them can resume from their prefixes."""
+    _, _, solutions, states = _load_solution_file(problem_set, response_dir)
+    for solution, state in zip(solutions, states):
+        if solution: # an empty plan has no prefixes
+            test_plan(solution, state, cache)
+
+def evaluate_solution_file(problem_set: str, response_dir: str, *, cache: PlanPrefixCache | None = None): #TODO - fix this up
+    """Evaluates the solutions from the `{response_dir}/solution_summary.json` file against the `problem_set` file. 
+    
+    Stores result data in `{response_dir}/solution_results.json` 
 
-    for problem in problems:
-        try:
-            model_used = solutions_dict[problem['tag']]['model_used']
-            solution = solutions_dict[problem['tag']]['solution']
-        except KeyError:
-            continue # skip over the ones not in the solution file
-        result_entry = ec.evaluate_blocksworld_solution(problem, solution, model_used)
-        results.append(result_entry)
+    Plans are validated all at once, or one by one through `cache` if given (to reuse prefixes validated in earlier rounds).
+    """
+    solution_file_path = f'{response_dir}/solution_summary.json'
+    problems, solutions_dict, solutions, states = _load_solution_file(problem_set, response_dir)
+    if cache is None:
+        test_results = test_plans(solutions, states) # validate them all at once
+    else:
+        test_results = [test_plan(solution, state, cache) for solution, state in zip(solutions, states)]
+    results = [
+        ec.evaluate_blocksworld_solution(problem, solution, solutions_dict[problem['tag']]['model_used'], test_result)
+        for problem, solution, test_result in zip(problems, solutions, test_results)
+    ]
     
     with open(f'{response_dir}/solution_results.json', 'w') as outfile:
         json.dump(results, outfile)
@@ -121,12 +333,16 @@ def do_blocksworld_error_correction(
         start_round: int = 0, 
         strategy: str = None,
         summarise_solutions: bool = True,
-        repeat_only: bool = False
+        repeat_only: bool = False,
+        resume: bool = False
     ):
 
     """Performs blocksworld error correction across the round directories in `parent_dir`. 
-    `repeat_only` if skipping the error information and just repeating the query as-is."""
+    `repeat_only` if skipping the error information and just repeating the query as-is.
+    `resume` continues in round directories that already exist (e.g. after a crash) instead of aborting. 
+    Only resume with the same `correction_model`, `strategy` and `repeat_only` as the interrupted run."""
 
+    cache = PlanPrefixCache() # corrected plans mostly share prefixes with the previous round's plans
     for current_round in range(start_round, stop_round + 1):
         print() # makes some space for the logs
         from_dir = f'{parent_dir}/round_{current_round}'
@@ -135,11 +351,14 @@ def do_blocksworld_error_correction(
         if not os.path.exists(from_dir):
             raise FileNotFoundError(f'Faulty from_dir : {from_dir}')
 
+        if current_round == start_round and summarise_solutions and os.path.exists(f'{from_dir}/solution_summary.json'):
+            warm_plan_cache(problem_set, from_dir, cache) # the first corrected round resumes from the plans it corrects
+
         solution_file_path = f'{from_dir}/solution_results.json'
-        ec.error_correct_blocksworld_solution_file(solution_file_path, to_dir, correction_model, strategy = strategy, repeat_only = repeat_only)
+        ec.error_correct_blocksworld_solution_file(solution_file_path, to_dir, correction_model, strategy = strategy, repeat_only = repeat_only, resume = resume)
         if summarise_solutions:
             generate_blocksworld_solutions_summary(problem_set, to_dir)
-            evaluate_solution_file(problem_set, to_dir)
+            evaluate_solution_file(problem_set, to_dir, cache = cache)
 
 def generate_blocksworld_strategies(num_strategies: int, model_name: str, target_dir: str):
     """Strongest model as of Dec 2024 is `o1-preview-2024-09-12`"""
@@ -159,38 +378,69 @@ def generate_initial_crt_solutions(
         answer_model: Literal['gpt-3.5-turbo-0125', 'gpt-4o-mini-2024-07-18', 'gpt-4o-2024-11-20', 'o1-mini-2024-09-12'], 
         *, 
         strategy: str | None = None, 
-        summary_model: str | None = 'o1-mini-2024-09-12' 
+        summary_model: str | None = 'o1-mini-2024-09-12',
+        max_concurrency: int = None,
+        local_evaluation: bool = True,
+        use_cache: bool = False
     ) -> None:
-    with open(problems_json_path) as infile:
-        problems_dict = json.load(infile)
+    """`max_concurrency` switches to async mode, with up to that many requests in flight (one at a time if None).
     
-    answer_dict = {}
-
-    for index, (prob_tag, value) in enumerate(problems_dict.items()):
-        print(f'Solving CRT {prob_tag} [{index + 1}/{len(problems_dict)}]', end = ' ')
-        answer_dict[prob_tag] = value
-        target_answer = answer_dict[prob_tag]['answer']
+    The answers are read from the `@@formula@@` locally, the summary model is only used for the formulas that cannot be parsed 
+    (or for all of them if `local_evaluation` is False). Every entry records the `formula` and the `extraction` used.
 
-        solution_text = ec.generate_crt_solution(value['question'], strategy, answer_model)
-        proposed_answer = ec.summarise_crt_solution(solution_text, summary_model)
+    With `use_cache`, answers to questions that were already asked are taken from the response cache (see `ec.get_response`), 
+    e.g. to pick a crashed run back up. Off by default, so running this again draws new answers.
 
-        answer_dict[prob_tag]['proposed_answer'] = proposed_answer
+    Answers are appended to the journal of `answer_json_path` as they come in (see journal.py), and compacted into `answer_json_path` 
+    once every problem has one. If a journal is left over from a run that stopped early (or had failed requests), 
+    the problems in it are not solved again, so running this again only asks the missing ones."""
+    with open(problems_json_path) as infile:
+        problems_dict = json.load(infile)
+    
+    def score(prob_tag: str, crt_answer: dict) -> dict:
+        entry = dict(problems_dict[prob_tag])
+        target_answer = entry['answer']
+        proposed_answer = crt_answer['proposed_answer']
+        entry['proposed_answer'] = proposed_answer
+        entry['formula'] = crt_answer['formula']
+        entry['extraction'] = crt_answer['extraction']
         if proposed_answer is None:
-            answer_dict[prob_tag]['result'] = 'UNPARSEABLE'
+            entry['result'] = 'UNPARSEABLE'
         elif target_answer['A'] == proposed_answer['A'] and target_answer['B'] == proposed_answer['B']:
-            answer_dict[prob_tag]['result'] = 'CORRECT'
+            entry['result'] = 'CORRECT'
         else:
-            answer_dict[prob_tag]['result'] = 'INCORRECT'
-
-        print(f'RESULT: {answer_dict[prob_tag]['result']}')
-
-        if index % 10 == 0:
-            print(f'Autosaving to {answer_json_path}.')
-            with open(answer_json_path, 'w') as outfile:
-                json.dump(answer_dict, outfile, indent = 2)
+            entry['result'] = 'INCORRECT'
+        return entry
+
+    with Journal(answer_json_path) as answers:
+        # failed requests used to be journaled with no `extraction`, those are asked again
+        pending = {prob_tag : value for prob_tag, value in problems_dict.items() if prob_tag not in answers or answers.records[prob_tag]['extraction'] is None}
+        if len(pending) < len(problems_dict):
+            print(f'Resuming from {answers.path} ({len(problems_dict) - len(pending)} problems already solved).')
+
+        if max_concurrency is not None:
+            def on_answer(prob_tag: str, crt_answer: dict):
+                answers.append(prob_tag, score(prob_tag, crt_answer))
+                print(f'RESULT for CRT {prob_tag}: {answers.records[prob_tag]['result']}')
+
+            ec.solve_crt_problems_async(
+                {prob_tag : value['question'] for prob_tag, value in pending.items()}, strategy, answer_model, summary_model, 
+                max_concurrency = max_concurrency, local_evaluation = local_evaluation, use_cache = use_cache, on_answer = on_answer
+            )
+        else:
+            for index, (prob_tag, value) in enumerate(pending.items()):
+                print(f'Solving CRT {prob_tag} [{index + 1}/{len(pending)}]', end = ' ')
+                solution_text = ec.generate_crt_solution(value['question'], strategy, answer_model, use_cache = use_cache)
+                crt_answer = ec.get_crt_answer(solution_text, summary_model, local_evaluation = local_evaluation)
+                answers.append(prob_tag, score(prob_tag, crt_answer))
+                print(f'RESULT: {answers.records[prob_tag]['result']}')
 
-    with open(answer_json_path, 'w') as outfile:
-        json.dump(answer_dict, outfile, indent = 2)
+        num_missing = sum(prob_tag not in answers or answers.records[prob_tag]['extraction'] is None for prob_tag in problems_dict)
+        if num_missing > 0:
+            print(f'WARNING: {num_missing} problems have no answer (failed requests), keeping {answers.path}. Run this again to retry them.')
+            return
+        answers.compact(list(problems_dict), indent = 2)
+    print(f'Saved {answer_json_path}')
 
 
 def generate_crt_strategies(num_strategies: int, model_name: str, target_dir: str):
@@ -239,7 +489,8 @@ def do_crt_error_correction(
             f'{solution_file_tag}_round_{current_round + 1}.json',
             correction_model,
             strategy = strategy,
-            summary_model = summary_model
+            summary_model = summary_model,
+            use_cache = False # the same question again, so it needs a new sample
         )
 
         os.remove(f'{solution_file}_temp_corrections.json') # delete any evidence of what we have done
\ No newline at end of file
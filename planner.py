@@ -0,0 +1,169 @@
+import heapq
+import time
+from itertools import count
+from typing import Literal
+
+from actions import BlocksAction, BlocksState, PickupAction, PutdownAction, StackAction, UnstackAction
+from block_code import goal_from_state
+
+# Heuristic search over the action classes in actions.py. States are `BlocksState`s, which hash and compare
+# independently of stack order, so the closed set holds one entry per canonical state.
+# Moves are read straight off the stacks (they are legal by construction), and the search keeps `(action class, objects)`
+# per state, so action strings are only built for the returned plan.
+
+def get_goal_positions(goal: tuple[str | int | None, list[list[str | int]]]) -> dict[str | int, tuple[str | int | None, int, int]]:
+    """Maps every block in the `goal` stacks to `(block below (None for the table), goal stack index, height in the goal stack)`."""
+    return {
+        block : (stack[height - 1] if height > 0 else None, stack_index, height) 
+        for stack_index, stack in enumerate(goal[1]) for height, block in enumerate(stack)
+    }
+
+def get_stack_cost(stack: list[str | int], goal_positions: dict[str | int, tuple[str | int | None, int, int]]) -> tuple[int, bool]:
+    """Returns the `goal_heuristic` moves for the blocks of one stack, and whether the whole stack is well placed (see `goal_heuristic`)."""
+    below, num_well_placed = None, 0
+    while num_well_placed < len(stack) and (position := goal_positions.get(stack[num_well_placed])) is not None and position[0] == below:
+        below = stack[num_well_placed]
+        num_well_placed += 1
+    if num_well_placed == len(stack):
+        return 0, True
+
+    h = 0
+    top_position = None if below is None else goal_positions[below]
+    min_height_below = {} # goal stack -> lowest goal height of the blocks below that are not well placed
+    for block in stack[num_well_placed:]:
+        position = goal_positions.get(block)
+        if position is None:
+            continue # not part of the goal
+        _, goal_stack, goal_height = position
+        if min_height_below.get(goal_stack, goal_height) < goal_height or (top_position is not None and top_position[1] == goal_stack and top_position[2] < goal_height):
+            h += 4
+        else:
+            h += 2
+        min_height_below[goal_stack] = min(goal_height, min_height_below.get(goal_stack, goal_height))
+    return h, False
+
+def goal_heuristic(
+        state: BlocksState, 
+        goal_positions: dict[str | int, tuple[str | int | None, int, int]], 
+        stack_costs: dict[tuple[str | int, ...], tuple[int, bool]] = None
+    ) -> int:
+    """Admissible lower bound on the number of actions left (0 only at the goal). Every action moves one block, so this counts moves per block.
+
+    A goal block is well placed if its whole stack, from the table up to the block, matches the goal. Those never have to move.
+    Every other block in a stack needs a pickup and a put (2 actions), or two of each (4 actions) if it has to be cleared away
+    before its goal position can be completed - which is the case if a block below it
+        - is one of its goal ancestors that is not well placed yet (that one has to move after it), or
+        - is the top well placed block of its goal stack, and it sits above it in the goal (the gap has to be filled first).
+    The block in the hand needs 1 action if it can go straight to its goal position, 3 otherwise.
+
+    For the `goal_from_state` tower this is exactly `get_solution_length` (with an empty hand).
+
+    `stack_costs` memoizes `get_stack_cost` by stack for one goal. An action only changes one or two stacks, 
+    so during a search most stacks are looked up instead of recounted.
+    """
+    h = 0
+    clear_well_placed = set() # well placed blocks on top of a stack
+    for stack in state.stacks.values():
+        if stack_costs is None:
+            stack_h, well_placed = get_stack_cost(stack, goal_positions)
+        elif (cost := stack_costs.get(key := tuple(stack))) is None:
+            stack_h, well_placed = stack_costs[key] = get_stack_cost(stack, goal_positions)
+        else:
+            stack_h, well_placed = cost
+        h += stack_h
+        if well_placed:
+            clear_well_placed.add(stack[-1])
+
+    position = goal_positions.get(state.holding)
+    if position is not None:
+        h += 1 if position[0] is None or position[0] in clear_well_placed else 3
+    return h
+
+def get_successors(state: BlocksState) -> list[tuple[type[BlocksAction], tuple[str | int, ...], BlocksState]]:
+    """Returns `(action class, objects, next_state)` for every applicable action. 
+    With an empty hand these are the pickups and unstacks of the top blocks, otherwise a putdown and a stack onto every top block.
+    Every `next_state` is a snapshot of `state` with the action applied in place."""
+    if state.holding is None:
+        moves = [(PickupAction, (stack[0],)) if len(stack) == 1 else (UnstackAction, (stack[-1], stack[-2])) for stack in state.stacks.values()]
+    else:
+        moves = [(PutdownAction, (state.holding,))] + [(StackAction, (state.holding, stack[-1])) for stack in state.stacks.values()]
+    return [(action_class, objects, action_class.try_apply(state, objects)) for action_class, objects in moves]
+
+def search_plan(
+        state: tuple[str | int | None, list[list[str | int]]],
+        goal: tuple[str | int | None, list[list[str | int]]] = None,
+        *,
+        mode: Literal['astar', 'gbfs'] = 'astar',
+        max_expansions: int = None
+    ) -> dict:
+    """Searches for a plan from `state` to `goal` (the `goal_from_state` tower if None).
+    `goal` is reached when every block in its stacks sits on the same block as in `goal` (blocks not in `goal` can be anywhere).
+
+    `mode`
+        - `astar` returns an optimal plan.
+        - `gbfs` (greedy best-first) only follows the heuristic, it is much faster but the plan can be longer than optimal.
+    
+    A* on random multi-stack goals of 18-20 blocks can generate a few hundred thousand states (several seconds), 
+    `max_expansions` bounds that.
+
+    Returns dict:
+        - `plan` is a list of `(action object object ...)` strings, or None if no plan was found (within `max_expansions`).
+        - `cost` is the length of the plan (or None).
+        - `expanded`, `generated` are the number of states expanded and generated, `seconds` the time taken.
+    """
+    if mode not in ('astar', 'gbfs'):
+        raise ValueError(f'Unknown search mode: {mode}')
+
+    start_time = time.perf_counter()
+    goal_positions = get_goal_positions(goal_from_state(state) if goal is None else goal)
+    start = BlocksState.from_tuple(state)
+    greedy = mode == 'gbfs'
+
+    parents: dict[BlocksState, tuple[BlocksState, type[BlocksAction], tuple[str | int, ...]] | None] = {start : None}
+    best_cost = {start : 0}
+    closed: set[BlocksState] = set()
+    tie_breaker = count() # keeps the heap from comparing states
+    stack_costs = {}
+    start_h = goal_heuristic(start, goal_positions, stack_costs)
+    open_heap = [(start_h, start_h, next(tie_breaker), 0, start)] # (priority, h, tie breaker, cost, state) - ties go to the lower h (deeper node)
+    expanded = generated = 0
+
+    def to_dict(plan_end: BlocksState | None) -> dict:
+        plan = None
+        if plan_end is not None:
+            plan = []
+            while parents[plan_end] is not None:
+                plan_end, action_class, objects = parents[plan_end]
+                plan.append(str(action_class(objects)))
+            plan.reverse()
+        return {
+            'plan' : plan,
+            'cost' : None if plan is None else len(plan),
+            'expanded' : expanded,
+            'generated' : generated,
+            'seconds' : time.perf_counter() - start_time
+        }
+
+    while open_heap:
+        _, h, _, cost, current = heapq.heappop(open_heap)
+        if cost > best_cost[current] or current in closed:
+            continue # stale heap entry
+        if h == 0: # every goal block is well placed
+            return to_dict(current)
+        if max_expansions is not None and expanded >= max_expansions:
+            break
+
+        closed.add(current)
+        expanded += 1
+        for action_class, objects, next_state in get_successors(current):
+            generated += 1
+            next_cost = cost + 1
+            if next_cost >= best_cost.get(next_state, next_cost + 1):
+                continue
+            closed.discard(next_state) # reopened if a cheaper path turns up (the heuristic is admissible, but not always consistent)
+            best_cost[next_state] = next_cost
+            parents[next_state] = (current, action_class, objects)
+            next_h = goal_heuristic(next_state, goal_positions, stack_costs)
+            heapq.heappush(open_heap, (next_h if greedy else next_cost + next_h, next_h, next(tie_breaker), next_cost, next_state))
+
+    return to_dict(None)
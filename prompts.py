@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Literal
 
 from block_code import state_to_pddl, goal_from_state
@@ -185,20 +186,38 @@ After a switch is flicked, the area of light shining within a room triples every
 I want you to write an explanation for a weaker LLM on how to solve similar problems. Note that the problems will have different numbers, thematic settings or even twists on algebraic variables, so make your strategy generalised.
 """
 
+# the same problems are prompted for every strategy x model x round, so the PDDL text and the task prompts are memoised.
+# States are keyed as `(holding, ((stack), ...))` tuples (stack order included, since it changes the text).
+PROMPT_CACHE_SIZE = 1 << 14
+
+def _state_key(state: tuple[str | int, list[list[str | int]]]) -> tuple[str | int | None, tuple[tuple[str | int, ...], ...]]:
+    return (state[0], tuple(tuple(stack) for stack in state[1]))
+
+@lru_cache(maxsize = PROMPT_CACHE_SIZE)
+def _get_pddl_text(state_key: tuple[str | int | None, tuple[tuple[str | int, ...], ...]], is_goal: bool = False) -> str:
+    return '\n'.join(state_to_pddl(state_key, is_goal = is_goal))
+
+def get_pddl_text(state: tuple[str | int, list[list[str | int]]], is_goal: bool = False) -> str:
+    """`state_to_pddl` joined into one string (one predicate per line), cached."""
+    return _get_pddl_text(_state_key(state), is_goal)
+
+@lru_cache(maxsize = PROMPT_CACHE_SIZE)
+def _get_blocksworld_task_prompt(state_key: tuple[str | int | None, tuple[tuple[str | int, ...], ...]], strategy: str | None) -> str:
+    return BLOCKSWORLD_TASK_PROMPT.format(
+        initial_state = _get_pddl_text(state_key), 
+        goal_state = _get_pddl_text(_state_key(goal_from_state(state_key)), True),
+        optional_strategy = BLOCKSWORLD_STRATEGY_HEADER.format(strategy_text = strategy) if strategy else ''
+    )
+
 def get_blocksworld_task_prompt(state: tuple[str | int, list[list[str | int]]], strategy: str | None = None) -> str:
     """Returns the prompt for solving a BlocksWorld PDDL task.
     
         - `state` is a BlocksWorld state [holding block, blocks_on_table]. 
         - `strategy` is the generalised strategy (`None` if no strategy).
+
+    Prompts are cached by `(state, strategy)` (the strategy text itself is the key).
     """
-    goal = goal_from_state(state)
-    initial_state_text = '\n'.join(state_to_pddl(state))
-    goal_state_text = '\n'.join(state_to_pddl(goal, is_goal = True))
-    return BLOCKSWORLD_TASK_PROMPT.format(
-        initial_state = initial_state_text, 
-        goal_state = goal_state_text,
-        optional_strategy = BLOCKSWORLD_STRATEGY_HEADER.format(strategy_text = strategy) if strategy else ''
-    )
+    return _get_blocksworld_task_prompt(_state_key(state), strategy)
 
 
 def get_blocksworld_fix_prompt(prompt_type: Literal['NOTGOAL', 'NOTEXECUTABLE'], last_action: list[str], final_state: tuple[str | int, list[list[str | int]]]):
@@ -212,7 +231,7 @@ def get_blocksworld_fix_prompt(prompt_type: Literal['NOTGOAL', 'NOTEXECUTABLE'],
     if not prompt_type in ('NOTGOAL', 'NOTEXECUTABLE'):
         raise ValueError(f'Weird fix_prompt type: {prompt_type}')
     
-    final_state_pddl = '\n'.join(state_to_pddl(final_state))
+    final_state_pddl = get_pddl_text(final_state) # shares the cache with the task prompts
 
     if prompt_type == 'NOTGOAL':
         return PDDL_FIX_PROMPT_NOTGOAL.format(final_state = final_state_pddl)
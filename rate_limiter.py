@@ -0,0 +1,274 @@
+import time
+import random
+import asyncio
+import threading
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat.chat_completion import ChatCompletion
+
+# Client-side rate limiting for the chat completions calls. Every model gets two token buckets, one for requests per minute
+# and one for tokens per minute, and a request reserves its estimated cost from both before it is sent (waiting until the
+# buckets refill if they are empty). The `x-ratelimit-*` response headers correct the limits and the bucket levels, and 429s /
+# transient errors are retried with jittered exponential backoff, which also pauses the model and lowers its rate for a while.
+
+DEFAULT_MODEL_LIMITS = {'rpm' : 500, 'tpm' : 200_000} # set these to your account tier, the headers correct them after the first response
+MODEL_LIMITS: dict[str, dict[str, int]] = {
+    'o1-mini-2024-09-12' : {'rpm' : 500, 'tpm' : 200_000},
+    'o1-preview-2024-09-12' : {'rpm' : 500, 'tpm' : 30_000}
+}
+
+EXPECTED_OUTPUT_TOKENS = 1_000 # reserved for the completion on top of the prompt (refunded / charged once the real usage is known)
+CHARS_PER_TOKEN = 4
+
+RETRY_SETTINGS = {
+    'max_attempts' : 8,
+    'base_delay' : 1.0, # seconds, doubled every attempt
+    'max_delay' : 60.0,
+    'rate_decrease' : 0.8, # the rate is multiplied by this after a 429
+    'min_rate_scale' : 0.1, # lowest fraction of the limits used after repeated 429s
+    'rate_recovery' : 0.02 # fraction of the limits recovered per successful request
+}
+
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) # includes timeouts
+
+def get_retry_after(headers) -> float | None:
+    """Seconds to wait from the `retry-after-ms` / `retry-after` headers of a 429, if there are any."""
+    if headers is None:
+        return None
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except ValueError: # `retry-after` can also be an HTTP date, the backoff is used instead then
+        pass
+    return None
+
+def estimate_prompt_tokens(messages: list[dict]) -> int:
+    """Rough token count of `messages` (about 4 characters per token, plus a few tokens per message)."""
+    num_chars = 0
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            num_chars += len(content)
+        else:
+            num_chars += sum(len(part.get('text', '')) for part in content)
+    return num_chars // CHARS_PER_TOKEN + 4 * len(messages)
+
+class TokenBucket:
+    """`capacity` tokens, refilled at `capacity / 60` per second. Reservations can take the level below 0, the caller then
+    waits until it would have refilled, so waiting requests are served in the order they reserved."""
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.level = capacity
+        self.last_refill = time.monotonic()
+
+    def refill(self, now: float, rate_scale: float = 1) -> None:
+        self.level = min(self.capacity, self.level + (now - self.last_refill) * self.capacity * rate_scale / 60)
+        self.last_refill = now
+
+    def reserve(self, amount: float, now: float, rate_scale: float = 1) -> float:
+        """Takes `amount` (at most the capacity) and returns the seconds until the bucket has covered it."""
+        self.refill(now, rate_scale)
+        self.level -= min(amount, self.capacity)
+        return 0 if self.level >= 0 else -self.level * 60 / (self.capacity * rate_scale)
+
+class ModelRateLimiter:
+    """The request and token buckets of one model, with the pause / rate scale state from 429s and the counters for `get_stats`."""
+    def __init__(self, model_name: str, rpm: int, tpm: int) -> None:
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.rate_scale = 1.0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+        self.queue_depth = 0 # requests waiting for budget
+        self.in_flight = 0
+        self.num_requests = self.num_retries = self.num_throttled = self.num_errors = 0
+        self.tokens_used = 0
+        self.wait_seconds = 0.0 # total time spent waiting for budget / backoff
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Reserves one request and `estimated_tokens`, returns the seconds to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(
+                self.requests.reserve(1, now, self.rate_scale),
+                self.tokens.reserve(estimated_tokens, now, self.rate_scale),
+                self.paused_until - now
+            )
+            return max(delay, 0)
+
+    def record_response(self, headers, estimated_tokens: int, used_tokens: int | None) -> None:
+        """Settles the token reservation with the real usage, and applies the `x-ratelimit-*` headers."""
+        with self._lock:
+            self.num_requests += 1
+            self.rate_scale = min(1.0, self.rate_scale + RETRY_SETTINGS['rate_recovery'])
+            if used_tokens is not None:
+                self.tokens.level += estimated_tokens - used_tokens
+                self.tokens_used += used_tokens
+            self._apply_headers(headers)
+
+    def release(self, estimated_tokens: int, headers = None) -> None:
+        """Refunds the request and token reservation of an attempt that failed (not counted as a request), 
+        so retries do not take the budget down by one reservation each. Applies the headers of the error response, if any."""
+        with self._lock:
+            now = time.monotonic()
+            for bucket, amount in ((self.requests, 1), (self.tokens, estimated_tokens)):
+                bucket.refill(now, self.rate_scale)
+                bucket.level = min(bucket.capacity, bucket.level + min(amount, bucket.capacity)) # `reserve` takes at most the capacity
+            self._apply_headers(headers)
+
+    def _apply_headers(self, headers) -> None:
+        """Corrects the limits and bucket levels from the `x-ratelimit-*` headers. Called with the lock held."""
+        if headers is None:
+            return
+
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, 'requests'), (self.tokens, 'tokens')):
+            try:
+                limit = int(headers[f'x-ratelimit-limit-{kind}'])
+                remaining = int(headers[f'x-ratelimit-remaining-{kind}'])
+            except (KeyError, ValueError):
+                continue
+            bucket.refill(now, self.rate_scale)
+            bucket.capacity = limit
+            bucket.level = min(bucket.level, remaining) # the provider also counts requests from elsewhere
+
+    def record_failure(self, error: Exception, attempt: int) -> float:
+        """Counts a failed attempt and returns the backoff before the next one. A 429 also pauses the model and lowers its rate."""
+        response = getattr(error, 'response', None)
+        retry_after = get_retry_after(None if response is None else response.headers)
+        backoff = min(RETRY_SETTINGS['max_delay'], RETRY_SETTINGS['base_delay'] * 2 ** attempt)
+        if retry_after is not None:
+            delay = retry_after * random.uniform(1, 1.25) # spread out so the waiting requests do not all come back at once
+        else:
+            delay = random.uniform(0, backoff) # full jitter
+        with self._lock:
+            self.num_retries += 1
+            if isinstance(error, openai.RateLimitError):
+                self.num_throttled += 1
+                now = time.monotonic()
+                if now >= self.paused_until: # 429s from requests that were already in flight count once
+                    self.rate_scale = max(RETRY_SETTINGS['min_rate_scale'], self.rate_scale * RETRY_SETTINGS['rate_decrease'])
+                self.paused_until = max(self.paused_until, now + delay) # everyone else waits too
+            else:
+                self.num_errors += 1
+        return delay
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self.requests.refill(time.monotonic(), self.rate_scale)
+            self.tokens.refill(time.monotonic(), self.rate_scale)
+            return {
+                'queue_depth' : self.queue_depth,
+                'in_flight' : self.in_flight,
+                'requests' : self.num_requests,
+                'retries' : self.num_retries,
+                'throttled' : self.num_throttled,
+                'errors' : self.num_errors,
+                'tokens_used' : self.tokens_used,
+                'wait_seconds' : round(self.wait_seconds, 3),
+                'rate_scale' : round(self.rate_scale, 3),
+                'rpm_limit' : self.requests.capacity,
+                'tpm_limit' : self.tokens.capacity,
+                'requests_available' : round(self.requests.level, 1),
+                'tokens_available' : round(self.tokens.level)
+            }
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.RateLimitError) and getattr(error, 'code', None) == 'insufficient_quota':
+        return False # out of credit, waiting will not help
+    return isinstance(error, _RETRYABLE_ERRORS)
+
+def _get_used_tokens(response: ChatCompletion) -> int | None:
+    usage = getattr(response, 'usage', None) # streams do not have it up front, their reservation stays at the estimate
+    return None if usage is None else usage.total_tokens
+
+class RateLimitScheduler:
+    """Holds a `ModelRateLimiter` per model (made on first use from `MODEL_LIMITS`) and sends requests through them."""
+    def __init__(self) -> None:
+        self.limiters: dict[str, ModelRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get_limiter(self, model_name: str) -> ModelRateLimiter:
+        with self._lock:
+            if model_name not in self.limiters:
+                limits = MODEL_LIMITS.get(model_name, DEFAULT_MODEL_LIMITS)
+                self.limiters[model_name] = ModelRateLimiter(model_name, limits['rpm'], limits['tpm'])
+            return self.limiters[model_name]
+
+    def create_completion(self, client: OpenAI, messages: list[dict], model_name: str, **params) -> ChatCompletion:
+        """`client.chat.completions.create` within the model's budget, retrying 429s and transient errors.
+        `params` are passed on (with `stream = True` this returns the stream, and only opening it is retried)."""
+        limiter = self.get_limiter(model_name)
+        estimated_tokens = estimate_prompt_tokens(messages) + EXPECTED_OUTPUT_TOKENS
+        client = client.with_options(max_retries = 0) # the retries happen here
+        for attempt in range(RETRY_SETTINGS['max_attempts']):
+            delay = limiter.reserve(estimated_tokens)
+            if delay > 0:
+                limiter.queue_depth += 1
+                time.sleep(delay)
+                limiter.queue_depth -= 1
+                limiter.wait_seconds += delay
+
+            limiter.in_flight += 1
+            try:
+                raw_response = client.chat.completions.with_raw_response.create(model = model_name, messages = messages, **params)
+            except Exception as error:
+                response = getattr(error, 'response', None)
+                limiter.release(estimated_tokens, None if response is None else response.headers) # the next attempt reserves again
+                if not _is_retryable(error) or attempt == RETRY_SETTINGS['max_attempts'] - 1:
+                    raise
+                backoff = limiter.record_failure(error, attempt)
+                print(f'WARNING: {model_name} request failed ({type(error).__name__}), retrying in {backoff:.1f}s')
+                time.sleep(backoff)
+                limiter.wait_seconds += backoff
+                continue
+            finally:
+                limiter.in_flight -= 1
+
+            response = raw_response.parse()
+            limiter.record_response(raw_response.headers, estimated_tokens, _get_used_tokens(response))
+            return response
+
+    async def create_completion_async(self, client: AsyncOpenAI, messages: list[dict], model_name: str, **params) -> ChatCompletion:
+        """Async version of `create_completion` (the budgets are shared with the sync one)."""
+        limiter = self.get_limiter(model_name)
+        estimated_tokens = estimate_prompt_tokens(messages) + EXPECTED_OUTPUT_TOKENS
+        client = client.with_options(max_retries = 0)
+        for attempt in range(RETRY_SETTINGS['max_attempts']):
+            delay = limiter.reserve(estimated_tokens)
+            if delay > 0:
+                limiter.queue_depth += 1
+                await asyncio.sleep(delay)
+                limiter.queue_depth -= 1
+                limiter.wait_seconds += delay
+
+            limiter.in_flight += 1
+            try:
+                raw_response = await client.chat.completions.with_raw_response.create(model = model_name, messages = messages, **params)
+            except Exception as error:
+                response = getattr(error, 'response', None)
+                limiter.release(estimated_tokens, None if response is None else response.headers) # the next attempt reserves again
+                if not _is_retryable(error) or attempt == RETRY_SETTINGS['max_attempts'] - 1:
+                    raise
+                backoff = limiter.record_failure(error, attempt)
+                print(f'WARNING: {model_name} request failed ({type(error).__name__}), retrying in {backoff:.1f}s')
+                await asyncio.sleep(backoff)
+                limiter.wait_seconds += backoff
+                continue
+            finally:
+                limiter.in_flight -= 1
+
+            response = raw_response.parse()
+            limiter.record_response(raw_response.headers, estimated_tokens, _get_used_tokens(response))
+            return response
+
+    def get_stats(self) -> dict[str, dict]:
+        """`{model : stats}` - queue depth, in flight, requests, retries, throttled (429s), time waited, current limits and budget."""
+        return {model_name : limiter.get_stats() for model_name, limiter in list(self.limiters.items())}
+
+RATE_LIMITER: RateLimitScheduler | None = RateLimitScheduler() # set to None to send requests directly (with the client's own retries)
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import hashlib
+
+from openai.types.chat.chat_completion import ChatCompletion
+
+# Content-addressed cache for API responses - a response is stored under the hash of (model, messages, params),
+# so re-running a stage (or restarting a crashed sweep) does not pay for requests that were already made.
+# Requests only use it when asked to (`use_cache = True`, see `get_response`) - the summary calls do, model answers are samples
+# and are only reused on purpose.
+
+RESPONSE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.response_cache')
+
+class ResponseCache:
+    """Stores `ChatCompletion`s as JSON files in `directory` (fanned out by the first two hash characters), 
+    each with the time it was stored (`{'stored_at' : ..., 'response' : ...}`).
+
+    Entries stored more than `max_age_days` ago are dropped when they are read, and once the cache grows past `max_bytes`
+    the least recently used entries (by modification time, which hits refresh) are evicted.
+    """
+    def __init__(self, directory: str = RESPONSE_CACHE_DIR, *, max_bytes: int = 1 << 30, max_age_days: float = 90) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = self.misses = self.bypassed = self.evicted = self.expired = 0
+        self._total_bytes: int | None = None # scanned on the first write
+
+    @staticmethod
+    def get_key(model_name: str, messages: list[dict], params: dict = None) -> str:
+        """sha256 of the canonical JSON of the request (keys sorted, no whitespace)."""
+        request = {'model' : model_name, 'messages' : messages, 'params' : params or {}}
+        return hashlib.sha256(json.dumps(request, sort_keys = True, separators = (',', ':')).encode()).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _iterate_entries(self):
+        """Yields `(path, size, mtime)` for every cached entry."""
+        if not os.path.isdir(self.directory):
+            return
+        for fan_out in os.scandir(self.directory):
+            if fan_out.is_dir():
+                for entry in os.scandir(fan_out.path):
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime
+
+    def get(self, key: str) -> ChatCompletion | None:
+        path = self._get_path(key)
+        try:
+            with open(path) as infile:
+                entry = json.load(infile)
+            expired = (time.time() - entry['stored_at']) / 86400 > self.max_age_days
+            response = None if expired else ChatCompletion.model_validate(entry['response'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError): # missing, or unreadable (treated as missing)
+            self.misses += 1
+            return None
+
+        if expired:
+            self._remove(path)
+            self.expired += 1
+            self.misses += 1
+            return None
+        os.utime(path) # marks it as recently used (the age comes from `stored_at`)
+        self.hits += 1
+        return response
+
+    def put(self, key: str, response: ChatCompletion) -> None:
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        data = f'{{"stored_at":{time.time()},"response":{response.model_dump_json()}}}'.encode()
+        try:
+            old_size = os.path.getsize(path) # the entry is overwritten
+        except FileNotFoundError:
+            old_size = 0
+        with open(f'{path}.tmp', 'wb') as outfile:
+            outfile.write(data)
+        os.replace(f'{path}.tmp', path) # never leaves a half-written entry behind
+
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._iterate_entries())
+        else:
+            self._total_bytes += len(data) - old_size
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        if self._total_bytes is not None:
+            self._total_bytes -= size
+
+    def evict(self) -> None:
+        """Removes the entries not used for `max_age_days` (so expired too), then the least recently used ones until the cache fits in `max_bytes`."""
+        entries = sorted(self._iterate_entries(), key = lambda entry: entry[2])
+        self._total_bytes = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.max_age_days * 86400
+        for path, _, mtime in entries:
+            if mtime >= cutoff and self._total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            self.evicted += 1
+
+    def clear(self) -> None:
+        for path, _, _ in list(self._iterate_entries()):
+            self._remove(path)
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : self.hits / lookups if lookups > 0 else None,
+            'bypassed' : self.bypassed,
+            'expired' : self.expired,
+            'evicted' : self.evicted
+        }
+
+    def __repr__(self) -> str:
+        return f'ResponseCache({self.directory}, {self.get_stats()})'
+
+RESPONSE_CACHE: ResponseCache | None = ResponseCache() # set to None to turn caching off
@@ -0,0 +1,194 @@
+import re
+
+from block_code import goal_from_state, state_to_pddl
+from prompts import BLOCKSWORLD_DOMAIN
+
+# Executes the operator text that the models see (e.g. `BLOCKSWORLD_DOMAIN`) instead of the hand-written action classes.
+# Every ground fact `(predicate object ...)` of a problem gets a bit, so a state is a single int, and a ground action is
+# three masks - `state & pre == pre` checks the preconditions and `state & ~delete | add` applies it.
+#
+# Note that this follows the domain text exactly, so `(unstack x y)` needs `(on x y)` and `(clear x)`. The action classes
+# (and so `test_plan`) only check that the block under the top of x's stack is y, so the two can disagree on plans
+# that unstack a block which is not on top.
+#
+# The parameters of an operator always stand for different blocks, so ground actions that repeat an object (e.g. `(stack b b)`)
+# are not executable. The domain text relies on this - `unstack` never deletes `(clear top-block)`, so the held block stays clear
+# and `(stack b b)` would otherwise pass its preconditions.
+
+_ACTION_LINE = re.compile(r'action\s*:\s*(\S+)\s*\(([^)]*)\)')
+_LITERAL = re.compile(r'(not\s*)?\(([^()]*)\)')
+
+class StripsOperator:
+    """A lifted operator - `preconds`, `add` and `delete` are lists of `(predicate, argument, ...)` tuples over `parameters`."""
+    def __init__(self, name: str, parameters: list[str], preconds: list[tuple[str, ...]], add: list[tuple[str, ...]], delete: list[tuple[str, ...]]) -> None:
+        self.name = name
+        self.parameters = parameters
+        self.preconds = preconds
+        self.add = add
+        self.delete = delete
+
+    def ground(self, objects: list[str]) -> tuple[list[tuple[str, ...]], list[tuple[str, ...]], list[tuple[str, ...]]]:
+        """Returns the `(preconds, add, delete)` facts with the parameters replaced by `objects`."""
+        binding = dict(zip(self.parameters, objects))
+        def substitute(atoms: list[tuple[str, ...]]) -> list[tuple[str, ...]]:
+            return [(atom[0], *(binding.get(argument, argument) for argument in atom[1:])) for atom in atoms]
+        return substitute(self.preconds), substitute(self.add), substitute(self.delete)
+
+    def __repr__(self) -> str:
+        return f'StripsOperator({self.name} {self.parameters})'
+
+def parse_fact(fact: str) -> tuple[str, ...]:
+    """`(on a b)` -> `('on', 'a', 'b')`"""
+    return tuple(fact.strip()[1:-1].split())
+
+def parse_domain(domain_text: str) -> dict[str, StripsOperator]:
+    """Parses operator text in the `BLOCKSWORLD_DOMAIN` format into `{name : StripsOperator}`. Each operator is
+
+        action : name (parameter parameter ...)
+        preconds : (predicate argument ...), ...
+        effects : (predicate argument ...), not(predicate argument ...), ...
+    """
+    operators = {}
+    for block in re.split(r'\n\s*\n', domain_text.strip()):
+        fields = {}
+        for line in block.strip().split('\n'):
+            key, _, value = line.partition(':')
+            fields[key.strip()] = value.strip()
+
+        match = _ACTION_LINE.match(block.strip())
+        if match is None or 'preconds' not in fields or 'effects' not in fields:
+            raise ValueError(f'Cannot parse operator:\n{block}')
+
+        effects = [(bool(negated), tuple(atom.split())) for negated, atom in _LITERAL.findall(fields['effects'])]
+        operators[match.group(1)] = StripsOperator(
+            match.group(1),
+            match.group(2).split(),
+            [tuple(atom.split()) for _, atom in _LITERAL.findall(fields['preconds'])],
+            [atom for negated, atom in effects if not negated],
+            [atom for negated, atom in effects if negated]
+        )
+    return operators
+
+class StripsDomain:
+    """Parsed operators plus the fact bits and ground actions, which are shared by every problem in the domain 
+    (facts get their bit on first use, ground actions are cached by their action string)."""
+    def __init__(self, operators: dict[str, StripsOperator]) -> None:
+        self.operators = operators
+        self.fact_bits: dict[tuple[str, ...], int] = {}
+        self.facts: list[tuple[str, ...]] = [] # bit -> fact
+        self._fact_masks: dict[str, int] = {} # fact string -> mask
+        self._ground_actions: dict[str, tuple[int, int, int] | None] = {}
+
+    @classmethod
+    def from_text(cls, domain_text: str) -> "StripsDomain":
+        return cls(parse_domain(domain_text))
+
+    def facts_to_mask(self, facts) -> int:
+        mask = 0
+        for fact in facts:
+            bit = self.fact_bits.get(fact)
+            if bit is None:
+                bit = self.fact_bits[fact] = len(self.facts)
+                self.facts.append(fact)
+            mask |= 1 << bit
+        return mask
+
+    def fact_strings_to_mask(self, facts: list[str]) -> int:
+        """Mask of `(predicate object ...)` strings."""
+        mask = 0
+        for fact in facts:
+            fact_mask = self._fact_masks.get(fact)
+            if fact_mask is None:
+                fact_mask = self._fact_masks[fact] = self.facts_to_mask([parse_fact(fact)])
+            mask |= fact_mask
+        return mask
+
+    def mask_to_facts(self, mask: int) -> list[tuple[str, ...]]:
+        facts = []
+        while mask:
+            lowest = mask & -mask
+            facts.append(self.facts[lowest.bit_length() - 1])
+            mask ^= lowest
+        return facts
+
+    def ground_action(self, action: str) -> tuple[int, int, int] | None:
+        """`(name object ...)` -> `(pre, add, delete)` masks, or None if there is no such operator, the arity is wrong or an object repeats."""
+        masks = self._ground_actions.get(action, False)
+        if masks is False:
+            tokens = action.strip()[1:-1].split()
+            operator = self.operators.get(tokens[0]) if len(tokens) > 0 else None
+            if operator is None or not len(tokens) - 1 == len(operator.parameters) or not len(set(tokens[1:])) == len(tokens) - 1:
+                masks = None
+            else:
+                preconds, add, delete = operator.ground(tokens[1:])
+                masks = (self.facts_to_mask(preconds), self.facts_to_mask(add), self.facts_to_mask(delete))
+            self._ground_actions[action] = masks
+        return masks
+
+    def run_plan(self, plan: list[str], initial_state: int, goal: int) -> tuple[str, int, list[int]]:
+        """Runs `plan` from the `initial_state` mask until it reaches the `goal` mask (every goal fact is true) or an action is not executable.
+
+        Returns `(result, last_index, states)`, with `result` as in `test_plan`, `last_index` the index of the last action evaluated
+        (-1 if none was, for an empty plan or an `initial_state` that already is the goal), and `states` the masks of the initial state and of the state after every executed action.
+        """
+        state = initial_state
+        states = [state]
+        if state & goal == goal:
+            return 'SUCCESS', -1, states
+        ground_actions = self._ground_actions
+        for last_index, action in enumerate(plan):
+            masks = ground_actions[action] if action in ground_actions else self.ground_action(action)
+            if masks is None or not state & masks[0] == masks[0]:
+                return 'NOTEXECUTABLE', last_index, states
+            state = state & ~masks[2] | masks[1] # deletes first, so an effect that is both added and deleted ends up true
+            states.append(state)
+            if state & goal == goal:
+                return 'SUCCESS', last_index, states
+        return 'NOTGOAL', len(plan) - 1, states
+
+BLOCKSWORLD = StripsDomain.from_text(BLOCKSWORLD_DOMAIN)
+
+def _blocksworld_state(states: list[int], initial_state: tuple[str | int | None, list[list[str | int]]]) -> tuple[str | int | None, list[list[str | int]]]:
+    """Decodes the last of `states` into `(holding, [stacks])` with the blocks of `initial_state` (the facts only hold their names), 
+    and the stacks in `test_plan` order (stacks from the initial state first, then in the order their bottom block was put down)."""
+    blocks = {str(block) : block for stack in initial_state[1] for block in stack}
+    if initial_state[0] is not None:
+        blocks[str(initial_state[0])] = initial_state[0]
+
+    holding, above, bottoms = None, {}, []
+    for fact in BLOCKSWORLD.mask_to_facts(states[-1]):
+        if fact[0] == 'holding':
+            holding = fact[1]
+        elif fact[0] == 'on':
+            above[fact[2]] = fact[1]
+        elif fact[0] == 'ontable':
+            bottoms.append(fact[1])
+
+    initial_order = {str(stack[0]) : index for index, stack in enumerate(initial_state[1]) if len(stack) > 0}
+    def put_down_at(bottom: str) -> tuple[int, int]:
+        bit = 1 << BLOCKSWORLD.fact_bits[('ontable', bottom)]
+        step = len(states) - 1
+        while step > 0 and states[step - 1] & bit:
+            step -= 1
+        return (step, initial_order.get(bottom, 0))
+
+    stacks = []
+    for bottom in sorted(bottoms, key = put_down_at):
+        stack = [bottom]
+        while stack[-1] in above:
+            stack.append(above[stack[-1]])
+        stacks.append([blocks[block] for block in stack])
+    return (None if holding is None else blocks[holding], stacks)
+
+def test_plan_strips(plan: list[str], state: tuple[str | int, list[list[str | int]]]) -> dict:
+    """Alternative to `test_plan` (same arguments and result dict) that validates against `BLOCKSWORLD_DOMAIN` with bitsets.
+    Not a drop-in: the two disagree on plans that unstack a block which is not on top of its stack - the domain text rejects them,
+    `test_plan` accepts them (see the note at the top). Otherwise the results match."""
+    initial_state = BLOCKSWORLD.fact_strings_to_mask(state_to_pddl(state))
+    goal = BLOCKSWORLD.fact_strings_to_mask(state_to_pddl(goal_from_state(state)))
+    result, last_index, states = BLOCKSWORLD.run_plan(plan, initial_state, goal)
+    return {
+        'result' : result,
+        'last_action' : plan[last_index] if last_index >= 0 else None,
+        'final_state' : _blocksworld_state(states, state)
+    }